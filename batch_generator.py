@@ -0,0 +1,201 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from car_poster_generator import CarPosterGenerator
+
+JOB_FIELDS = ('make', 'model', 'year', 'trim', 'color', 'output_path')
+
+
+def load_jobs(path):
+    """Чтение списка автомобилей из CSV (с заголовком) или JSONL"""
+    path = Path(path)
+    jobs = []
+
+    if path.suffix.lower() in ('.jsonl', '.json'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    jobs.append(json.loads(line))
+    else:
+        with open(path, encoding='utf-8', newline='') as f:
+            jobs.extend(csv.DictReader(f))
+
+    normalized = []
+    for index, job in enumerate(jobs):
+        job = {field: (job.get(field) or None) for field in JOB_FIELDS}
+        if not job['make'] or not job['model']:
+            raise ValueError(f"Строка {index + 1}: марка и модель обязательны")
+        if job['year'] is not None:
+            job['year'] = int(job['year'])
+        normalized.append(job)
+    return normalized
+
+
+class BatchPosterGenerator:
+    """
+    Пакетная генерация постеров с ограниченным параллелизмом.
+    Поиск характеристик и генерация изображений идут в отдельных пулах потоков,
+    поэтому поиск для следующего автомобиля перекрывается с генерацией текущего.
+    """
+
+    def __init__(self, generator, spec_concurrency=None, image_concurrency=None, spec_chunk_size=None):
+        self.generator = generator
+        self.spec_concurrency = spec_concurrency or int(os.getenv('SPEC_CONCURRENCY', 4))
+        self.image_concurrency = image_concurrency or int(os.getenv('IMAGE_CONCURRENCY', 2))
+        # 0 - отдельный запрос характеристик на каждый автомобиль
+        self.spec_chunk_size = int(os.getenv('SPEC_BULK_CHUNK_SIZE', 0)) if spec_chunk_size is None else spec_chunk_size
+
+    def _default_output_path(self, job, specs):
+        """Имя файла с цветом, чтобы разные цвета одной модели не перезаписывали друг друга"""
+        if not job['color']:
+            return None
+        output_dir = Path(self.generator.output_directory)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        year = job['year'] or specs['year_range']
+        color = '_'.join(job['color'].split())
+        return output_dir / f"{job['make']}_{job['model']}_{year}_{color}.{self.generator.output_format}"
+
+    def run(self, jobs):
+        """Запуск пакета. Ошибка одного задания не прерывает остальные."""
+        results = [None] * len(jobs)
+        remaining = threading.Semaphore(0)
+
+        if self.generator.hedger is not None:
+            self.generator.hedger.reset_budget()
+            self.generator.hedger.ensure_capacity(self.image_concurrency)
+
+        spec_pool = ThreadPoolExecutor(max_workers=self.spec_concurrency, thread_name_prefix='spec')
+        image_pool = ThreadPoolExecutor(max_workers=self.image_concurrency, thread_name_prefix='image')
+
+        def finish(index, job, started, output=None, error=None):
+            results[index] = {
+                **job,
+                'status': 'ok' if error is None else 'error',
+                'output': output,
+                'error': None if error is None else f"{type(error).__name__}: {error}",
+                'seconds': round(time.monotonic() - started, 2),
+            }
+            remaining.release()
+
+        def render(index, job, specs, started):
+            try:
+                output = self.generator.generate_poster_from_specs(
+                    specs, job['make'], job['model'], job['year'], job['color'],
+                    job['output_path'] or self._default_output_path(job, specs), trim=job.get('trim')
+                )
+            except Exception as e:
+                finish(index, job, started, error=e)
+            else:
+                finish(index, job, started, output=output)
+
+        def lookup(index, job):
+            started = time.monotonic()
+            try:
+                specs = self.generator.search_car_specifications(
+                    job['make'], job['model'], job['year'], job['trim']
+                )
+                image_pool.submit(render, index, job, specs, started)
+            except Exception as e:
+                finish(index, job, started, error=e)
+
+        def lookup_chunk(indexes):
+            started = time.monotonic()
+            try:
+                found = self.generator.search_car_specifications_bulk(
+                    [jobs[index] for index in indexes], chunk_size=len(indexes)
+                )
+            except Exception as e:
+                for index in indexes:
+                    finish(index, jobs[index], started, error=e)
+                return
+            for index, specs in zip(indexes, found):
+                image_pool.submit(render, index, jobs[index], specs, started)
+
+        try:
+            if self.spec_chunk_size:
+                for start in range(0, len(jobs), self.spec_chunk_size):
+                    spec_pool.submit(lookup_chunk, list(range(start, min(start + self.spec_chunk_size, len(jobs)))))
+            else:
+                for index, job in enumerate(jobs):
+                    spec_pool.submit(lookup, index, job)
+            for _ in jobs:
+                remaining.acquire()
+        finally:
+            spec_pool.shutdown(wait=True)
+            image_pool.shutdown(wait=True)
+
+        # Производные версии кодировались в фоне - дожидаемся и добавляем манифесты
+        manifests = self.generator.collect_derivatives()
+        for result in results:
+            if result['output'] in manifests:
+                result['derivatives'] = manifests[result['output']]
+
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная генерация постеров из CSV/JSONL")
+    parser.add_argument('jobs', help="CSV или JSONL: make, model, year, trim, color, output_path")
+    parser.add_argument('--spec-concurrency', type=int, default=None,
+                        help="Параллельных запросов характеристик (SPEC_CONCURRENCY)")
+    parser.add_argument('--image-concurrency', type=int, default=None,
+                        help="Параллельных генераций изображений (IMAGE_CONCURRENCY)")
+    parser.add_argument('--spec-chunk-size', type=int, default=None,
+                        help="Автомобилей в одном запросе характеристик, 0 - по одному (SPEC_BULK_CHUNK_SIZE)")
+    parser.add_argument('--format', choices=['png', 'jpg'], default=None, help="Формат постеров")
+    parser.add_argument('--report', default=None, help="Файл JSONL с результатами по каждому заданию")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.jobs)
+    print(f"🚗 Пакетная генерация: {len(jobs)} автомобилей")
+
+    generator = CarPosterGenerator(output_format=args.format)
+    batch = BatchPosterGenerator(
+        generator, args.spec_concurrency, args.image_concurrency, args.spec_chunk_size
+    )
+
+    started = time.monotonic()
+    try:
+        results = batch.run(jobs)
+    finally:
+        if generator.derivative_pipeline is not None:
+            generator.derivative_pipeline.close()
+    elapsed = time.monotonic() - started
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    failed = [r for r in results if r['status'] != 'ok']
+    print(f"\n{'='*70}")
+    print(f"✅ Успешно: {len(results) - len(failed)}   ❌ Ошибок: {len(failed)}   ⏱ {elapsed:.1f} с")
+    for result in failed:
+        print(f"   ❌ {result['make']} {result['model']}: {result['error']}")
+    api = generator.gemini.stats()
+    print(f"🔁 Запросов к API: {api['calls']}, повторов: {api['retries']}, "
+          f"ожидание лимитов: {api['throttled_seconds']:.1f} с, паузы повторов: {api['backoff_seconds']:.1f} с")
+    for stage, latency in generator.metrics.summary().items():
+        print(f"⏱ {stage}: {latency['count']} шт., среднее {latency['mean']:.2f} с, "
+              f"p50 ≤{latency['p50']} с, p95 ≤{latency['p95']} с, p99 ≤{latency['p99']} с")
+    prometheus_path = generator.metrics.write_prometheus()
+    if prometheus_path:
+        print(f"📈 Метрики Prometheus: {prometheus_path}")
+    if generator.hedger is not None:
+        hedges = generator.hedger.stats()
+        print(f"🔀 Дублирующих запросов: {hedges['hedges_fired']}, из них быстрее основного: {hedges['hedges_won']}")
+    print(f"{'='*70}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
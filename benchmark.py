@@ -0,0 +1,185 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+from fake_gemini import FakeGeminiClient, LatencyModel
+
+DEFAULT_SIZES = (1, 10, 100, 1000)
+
+# Настройки, которые иначе пришли бы из .env пользователя и исказили замер
+PINNED_ENV = {
+    'POSTER_MODE': 'ai',
+    'IMAGE_HEDGING': 'false',
+    'SPEC_INDEX_SOURCES': '',
+    'DERIVATIVES_ENABLED': 'false',
+    'OUTPUT_PASSTHROUGH': 'true',
+    'PNG_OPTIMIZE': 'true',
+    'PROMPT_VARIANT': 'verbose',
+    'PROMPT_TOKEN_COUNT': 'local',
+    'METRICS_JSONL_PATH': '',
+    'METRICS_PROMETHEUS_PATH': '',
+    'GEMINI_MAX_RETRIES': '5',
+    'GEMINI_BACKOFF_MAX': '60',
+    **{f'{prefix}_{limit}': '0' for prefix in ('SPEC_MODEL', 'IMAGE_MODEL') for limit in ('RPM', 'TPM', 'MAX_CONCURRENCY')},
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Пиковая память процесса (ru_maxrss: КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_jobs(count):
+    """Разные автомобили и цвета, чтобы кэши не подменяли генерацию"""
+    return [
+        {
+            'make': f"Make{index % 50}",
+            'model': f"Model{index}",
+            'year': 2020 + index % 5,
+            'trim': None,
+            'color': f"Color{index % 7}",
+            'output_path': None,
+        }
+        for index in range(count)
+    ]
+
+
+def run_scenario(count, args, workdir):
+    # Импорт после настройки окружения: генератор читает .env при создании
+    from batch_generator import BatchPosterGenerator
+    from car_poster_generator import CarPosterGenerator
+
+    scenario_dir = Path(workdir) / f"run_{count}"
+    os.environ.update({
+        **PINNED_ENV,
+        'OUTPUT_DIRECTORY': str(scenario_dir / 'output'),
+        'SPEC_CACHE_PATH': str(scenario_dir / 'specs.sqlite3'),
+        'POSTER_CACHE_DIR': str(scenario_dir / 'posters'),
+        'REFERENCE_CACHE_DIR': str(scenario_dir / 'reference'),
+        'SPEC_CACHE_ENABLED': 'true' if args.with_caches else 'false',
+        'POSTER_CACHE_ENABLED': 'true' if args.with_caches else 'false',
+        'GEMINI_BACKOFF_BASE': str(0.2 * args.latency_scale),
+    })
+
+    client = FakeGeminiClient(
+        spec_latency=LatencyModel(args.spec_latency, 0.4, args.latency_scale),
+        image_latency=LatencyModel(args.image_latency, 0.35, args.latency_scale),
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        text_only_rate=args.text_only_rate,
+        image_size=tuple(args.image_size),
+        seed=count,
+    )
+
+    # Логи генератора не нужны в отчете бенчмарка
+    with redirect_stdout(StringIO()):
+        generator = CarPosterGenerator(reference_image_path=args.reference, output_format=args.format, client=client)
+        jobs = make_jobs(count)
+
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        if count == 1:
+            job = jobs[0]
+            job_started = time.perf_counter()
+            try:
+                generator.generate_poster(job['make'], job['model'], job['year'], color=job['color'])
+                results = [{'status': 'ok', 'seconds': time.perf_counter() - job_started}]
+            except Exception:
+                results = [{'status': 'error', 'seconds': time.perf_counter() - job_started}]
+        else:
+            batch = BatchPosterGenerator(generator, args.spec_concurrency, args.image_concurrency)
+            results = batch.run(jobs)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    # Постеры больше не нужны, а на 1000 штук занимают гигабайты
+    shutil.rmtree(scenario_dir, ignore_errors=True)
+
+    latencies = [result['seconds'] for result in results if result['status'] == 'ok']
+    ok = len(latencies)
+    api = generator.gemini.stats()
+    return {
+        'ts': round(time.time(), 3),
+        'posters': count,
+        'ok': ok,
+        'failed': count - ok,
+        'elapsed_s': round(elapsed, 3),
+        'posters_per_minute': round(ok / elapsed * 60, 2) if elapsed else 0.0,
+        'p50_s': round(percentile(latencies, 0.50), 3),
+        'p95_s': round(percentile(latencies, 0.95), 3),
+        'p99_s': round(percentile(latencies, 0.99), 3),
+        'mean_s': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        'cpu_ms_per_poster': round(cpu / count * 1000, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'api_calls': api['calls'],
+        'retries': api['retries'],
+        'latency_scale': args.latency_scale,
+    }
+
+
+def run_isolated(count, args, workdir):
+    """Сценарий в отдельном процессе: пиковая память и импорты не копятся между размерами"""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_scenario, (count, args, workdir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк генератора постеров на имитации Gemini")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Размеры прогонов: 1 - одиночный постер, иначе пакет")
+    parser.add_argument('--latency-scale', type=float, default=0.01,
+                        help="Множитель задержек имитации (1.0 - реальные 1.5 с / 20 с)")
+    parser.add_argument('--spec-latency', type=float, default=1.5, help="Медиана задержки поиска характеристик, с")
+    parser.add_argument('--image-latency', type=float, default=20.0, help="Медиана задержки генерации изображения, с")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.02, help="Доля ответов 429")
+    parser.add_argument('--server-error-rate', type=float, default=0.01, help="Доля ответов 5xx")
+    parser.add_argument('--text-only-rate', type=float, default=0.0, help="Доля ответов без изображения")
+    parser.add_argument('--image-size', type=int, nargs=2, default=[1024, 1365], metavar=('W', 'H'))
+    parser.add_argument('--spec-concurrency', type=int, default=8)
+    parser.add_argument('--image-concurrency', type=int, default=8)
+    parser.add_argument('--format', choices=['png', 'jpg'], default='png')
+    parser.add_argument('--reference', default='photo_2026-02-13_02-02-39.jpg')
+    parser.add_argument('--with-caches', action='store_true', help="Не отключать кэши характеристик и постеров")
+    parser.add_argument('--output', default='benchmarks/results.jsonl', help="Куда дописывать результаты (JSONL)")
+    args = parser.parse_args(argv)
+
+    print(f"{'постеров':>9} {'ок':>5} {'пост/мин':>10} {'p50 с':>8} {'p95 с':>8} {'p99 с':>8} "
+          f"{'CPU мс':>8} {'RSS МБ':>8} {'повторов':>9}")
+
+    with tempfile.TemporaryDirectory(prefix='poster_bench_') as workdir:
+        for count in args.sizes:
+            result = run_isolated(count, args, workdir)
+            print(f"{result['posters']:>9} {result['ok']:>5} {result['posters_per_minute']:>10} "
+                  f"{result['p50_s']:>8} {result['p95_s']:>8} {result['p99_s']:>8} "
+                  f"{result['cpu_ms_per_poster']:>8} {result['peak_rss_mb']:>8} {result['retries']:>9}")
+
+            if args.output:
+                Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+                with open(args.output, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    if args.output:
+        print(f"\n📈 Результаты добавлены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
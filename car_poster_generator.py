@@ -1,91 +1,422 @@
 import os
 import json
-from PIL import Image
+import hashlib
+import shutil
+import threading
 from io import BytesIO
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 from pathlib import Path
+from spec_cache import SpecCache
+from spec_index import SpecIndex
+from poster_cache import PosterCache, MIME_EXTENSIONS
+from gemini_calls import GeminiCallLayer, ModelLimiter
+from hedging import RequestHedger
+from metrics import PipelineMetrics
+from prompt_templates import count_tokens, load_template
+
+# google-genai, Pillow и python-dotenv импортируются при первом использовании:
+# короткие запуски, которые отвечают из кэша, не тратят на них время (см. startup_benchmark.py)
+_env_loaded = False
+
+# Поля характеристик, которые возвращает поиск
+SPEC_FIELDS = (
+    'make', 'model', 'year_range', 'engine', 'power',
+    'torque', 'weight', 'acceleration', 'top_speed', 'country_code',
+)
+
+# Автомобилей в одном пакетном запросе характеристик по умолчанию
+DEFAULT_SPEC_BULK_CHUNK_SIZE = 25
+
+# Схема JSON для промптов поиска характеристик
+SPEC_JSON_SCHEMA = """{
+    "make": "Марка автомобиля (точное официальное название)",
+    "model": "Модель (точное официальное название)",
+    "year_range": "Год или диапазон годов производства этого поколения (например: 2020-2024 или 2023)",
+    "engine": "Двигатель - объем и тип (формат: 3.0L Twin-Turbo I6)",
+    "power": "Мощность в лошадиных силах (формат: 503 HP)",
+    "torque": "Крутящий момент (формат: 650 Nm)",
+    "weight": "Снаряженная масса (формат: 1725 kg)",
+    "acceleration": "Разгон 0-100 км/ч (формат: 3.9 s)",
+    "top_speed": "Максимальная скорость (формат: 250 km/h)",
+    "country_code": "Двухбуквенный ISO код страны производителя (DE-Германия, US-США, JP-Япония, IT-Италия, GB-Великобритания, FR-Франция, KR-Корея, SE-Швеция, CZ-Чехия)"
+}"""
+
+
+def load_env():
+    """Однократная загрузка .env в окружение процесса"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def _env_flag(name, default='false'):
+    """Чтение булевого флага из .env"""
+    return os.getenv(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
 
-load_dotenv()
 
 class CarPosterGenerator:
     
-    def __init__(self, reference_image_path=None, output_format=None):
+    # Модель поиска характеристик
+    spec_model = 'gemini-2.0-flash-exp'
+    
+    # Модель и настройки генерации постера (входят в ключ кэша постеров)
+    image_model = 'gemini-3-pro-image-preview'
+    image_temperature = 0.3
+    
+    def __init__(self, reference_image_path=None, output_format=None, client=None):
+        """
+        client - готовый клиент с интерфейсом client.models.generate_content
+        (например, FakeGeminiClient для тестов и бенчмарков); по умолчанию genai.Client из .env,
+        который создается при первом запросе к API
+        """
         # Загрузка настроек из .env
+        load_env()
+        # Референс проверяется при первой генерации постера: поиску характеристик он не нужен
         self.reference_path = reference_image_path or os.getenv('REFERENCE_IMAGE_PATH')
-        if not self.reference_path:
-            raise ValueError("REFERENCE_IMAGE_PATH не указан в .env файле и не передан в параметрах!")
         
         self.output_format = (output_format or os.getenv('DEFAULT_OUTPUT_FORMAT', 'png')).lower()
         self.output_directory = os.getenv('OUTPUT_DIRECTORY', 'output')
         
-        # API ключ
+        # Запись байтов из ответа API без перекодирования, если формат совпадает
+        self.output_passthrough = _env_flag('OUTPUT_PASSTHROUGH', 'true')
+        # Сжатие PNG при перекодировании: optimize - максимальное, но медленное
+        self.png_optimize = _env_flag('PNG_OPTIMIZE', 'true')
+        self.png_compress_level = int(os.getenv('PNG_COMPRESS_LEVEL', 6))
+        
+        # Метрики этапов: хуки через self.metrics.add_hook(), выгрузка JSONL/Prometheus из .env
+        self.metrics = PipelineMetrics.from_env()
+        
+        # Все запросы идут через общий слой: лимиты RPM/TPM по модели, повторы, статистика
+        self.gemini = GeminiCallLayer(client, limiters={
+            self.spec_model: ModelLimiter.from_env('SPEC_MODEL'),
+            self.image_model: ModelLimiter.from_env('IMAGE_MODEL'),
+        }, metrics=self.metrics, client_factory=self._create_client)
+        
+        # Дублирующие запросы изображения при долгом или пустом ответе
+        self.hedger = RequestHedger() if _env_flag('IMAGE_HEDGING') else None
+        
+        # Режим: ai - весь постер рисует модель, hybrid - модель рисует только автомобиль,
+        # а текст, характеристики и флаг верстаются локально (poster_layout.py)
+        self.poster_mode = os.getenv('POSTER_MODE', 'ai').lower()
+        self.poster_language = os.getenv('POSTER_LANGUAGE', 'en')
+        self.car_render_cache = None
+        if self.poster_mode == 'hybrid':
+            self.car_render_cache = PosterCache(os.getenv('CAR_RENDER_CACHE_DIR', 'cache/car_renders'))
+        
+        # Шаблон промпта (prompts/poster.<вариант>.txt) и бюджет токенов для A/B сравнения вариантов
+        self.prompt_variant = os.getenv('PROMPT_VARIANT', 'verbose')
+        self.prompt_token_count = os.getenv('PROMPT_TOKEN_COUNT', 'local').lower()
+        self.prompt_token_budget = int(os.getenv('PROMPT_TOKEN_BUDGET', 0))
+        self._prompt_budget_warned = set()
+        
+        # Референс подготавливается при первой генерации постера (см. свойство reference)
+        self._reference = None
+        self._reference_part = None
+        self._reference_lock = threading.Lock()
+        
+        # Кэш характеристик (SQLite), можно отключить через SPEC_CACHE_ENABLED=false
+        self.spec_cache = None
+        if _env_flag('SPEC_CACHE_ENABLED', 'true'):
+            self.spec_cache = SpecCache(
+                path=os.getenv('SPEC_CACHE_PATH', 'cache/specs.sqlite3'),
+                ttl_seconds=float(os.getenv('SPEC_CACHE_TTL', 30 * 24 * 3600)),
+                max_entries=int(os.getenv('SPEC_CACHE_MAX_ENTRIES', 5000)),
+            )
+        
+        # Локальный индекс характеристик (CSV/JSON), совпадения не требуют запроса к API
+        self.spec_index = None
+        index_sources = [path.strip() for path in os.getenv('SPEC_INDEX_SOURCES', '').split(',') if path.strip()]
+        if index_sources:
+            self.spec_index = SpecIndex.load_or_build(
+                os.getenv('SPEC_INDEX_PATH', 'cache/spec_index.pickle'), index_sources, SPEC_FIELDS
+            )
+        self.spec_index_min_score = float(os.getenv('SPEC_INDEX_MIN_SCORE', 0.85))
+        self.spec_index_fallback_score = float(os.getenv('SPEC_INDEX_FALLBACK_SCORE', 0.7))
+        
+        # Кэш готовых постеров, можно отключить через POSTER_CACHE_ENABLED=false
+        self.poster_cache = None
+        if _env_flag('POSTER_CACHE_ENABLED', 'true'):
+            self.poster_cache = PosterCache(os.getenv('POSTER_CACHE_DIR', 'cache/posters'))
+        
+        # Производные версии (превью, соцсети, печать) кодируются в пуле процессов
+        self.derivative_pipeline = None
+        if _env_flag('DERIVATIVES_ENABLED'):
+            from derivatives import DerivativePipeline, load_derivatives_config
+            self.derivative_pipeline = DerivativePipeline(load_derivatives_config(os.getenv('DERIVATIVES_CONFIG')))
+        
+    @staticmethod
+    def _create_client():
+        """Клиент genai из .env; вызывается слоем GeminiCallLayer при первом запросе"""
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key:
             raise ValueError("GEMINI_API_KEY не найден в .env файле!")
         
         # Инициализация нового SDK
-        self.client = genai.Client(api_key=api_key)
-        
-        # Проверка существования референсного изображения
+        from google import genai
+        return genai.Client(api_key=api_key)
+    
+    @property
+    def client(self):
+        return self.gemini.client
+    
+    @client.setter
+    def client(self, client):
+        self.gemini.client = client
+    
+    def _check_reference_path(self):
+        if not self.reference_path:
+            raise ValueError("REFERENCE_IMAGE_PATH не указан в .env файле и не передан в параметрах!")
         if not os.path.exists(self.reference_path):
             raise ValueError(f"Референсное изображение не найдено: {self.reference_path}")
+    
+    @property
+    def poster_template(self):
+        """Шаблон читается с диска при первой генерации постера, дальше берется из кэша load_template"""
+        return load_template('poster', self.prompt_variant)
+    
+    @property
+    def reference(self):
+        """Референс, уменьшенный и перекодированный один раз; дальше отправляются готовые байты"""
+        if self._reference is None:
+            with self._reference_lock:
+                if self._reference is None:
+                    self._check_reference_path()
+                    from reference_image import prepare_reference_image
+                    reference = prepare_reference_image(
+                        self.reference_path,
+                        max_edge=int(os.getenv('REFERENCE_MAX_EDGE', 1536)),
+                        image_format=os.getenv('REFERENCE_FORMAT', 'jpeg'),
+                        quality=int(os.getenv('REFERENCE_QUALITY', 85)),
+                        cache_dir=os.getenv('REFERENCE_CACHE_DIR', 'cache/reference'),
+                    )
+                    width, height = reference.size
+                    print(f"✅ Референсное изображение загружено: {self.reference_path}")
+                    print(f"   К отправке: {width}x{height}, {reference.payload_bytes / 1024:.0f} KB "
+                          f"(исходник {reference.source_bytes / 1024:.0f} KB)")
+                    self._reference = reference
+        return self._reference
+    
+    @property
+    def reference_part(self):
+        if self._reference_part is None:
+            from google.genai import types
+            self._reference_part = types.Part.from_bytes(data=self.reference.data, mime_type=self.reference.mime_type)
+        return self._reference_part
+    
+    @property
+    def reference_image(self):
+        """Исходное референсное изображение (PIL Image)"""
+        self._check_reference_path()
+        from PIL import Image
+        return Image.open(self.reference_path)
+    
+    def search_car_specifications(self, make, model, year=None, trim=None, use_cache=True, refresh_cache=False,
+                                  use_api=True):
+        """
+        Поиск технических характеристик автомобиля через Gemini
         
-        self.reference_image = Image.open(self.reference_path)
-        print(f"✅ Референсное изображение загружено: {self.reference_path}")
-        
-    def search_car_specifications(self, make, model, year=None, trim=None):
-        """Поиск технических характеристик автомобиля через Gemini"""
+        use_cache=False - не читать и не записывать кэш
+        refresh_cache=True - игнорировать кэш при чтении, но обновить запись
+        use_api=False - только локальный индекс и кэш; при промахе возвращается None
+        """
         print(f"🔍 Поиск характеристик: {make} {model}...")
         
-        query = f"{make} {model}"
-        if year:
-            query += f" {year}"
-        if trim:
-            query += f" {trim}"
+        with self.metrics.stage('spec_lookup', make=make, model_name=model) as event:
+            specs, event['outcome'] = self._resolve_car_specifications(
+                make, model, year, trim, use_cache, refresh_cache, use_api
+            )
+        return specs
+    
+    def _resolve_car_specifications(self, make, model, year, trim, use_cache, refresh_cache, use_api=True):
+        """Индекс -> кэш -> API -> fallback; возвращает (характеристики, источник)"""
+        index_specs, index_score = self._lookup_spec_index(make, model, year, trim)
+        if index_score >= self.spec_index_min_score:
+            print(f"📚 Характеристики из локального индекса (совпадение {index_score:.0%})")
+            return index_specs, 'index'
+        
+        cache = self.spec_cache if use_cache else None
+        if cache is not None and not refresh_cache:
+            cached = cache.get(make, model, year, trim)
+            if cached is not None:
+                print("⚡ Характеристики взяты из кэша")
+                return cached, 'cache'
+        
+        if not use_api:
+            if index_specs is not None and index_score >= self.spec_index_fallback_score:
+                print(f"📚 Ближайшая запись локального индекса (совпадение {index_score:.0%})")
+                return index_specs, 'index_fallback'
+            return None, 'miss'
+        
+        try:
+            specs = self._request_car_specifications(make, model, year, trim)
+        except Exception as e:
+            print(f"⚠️ Ошибка поиска характеристик: {e}")
+            if index_specs is not None and index_score >= self.spec_index_fallback_score:
+                print(f"📚 Использую ближайшую запись локального индекса (совпадение {index_score:.0%})")
+                return index_specs, 'index_fallback'
+            print("📋 Использую базовые характеристики...")
+            # Базовые характеристики в кэш не попадают
+            return self._get_default_specs(make, model, year), 'default'
+        
+        if cache is not None:
+            cache.put(make, model, year, trim, specs)
+        return specs, 'api'
+    
+    def _lookup_spec_index(self, make, model, year=None, trim=None):
+        """Поиск в локальном индексе: (характеристики, оценка) или (None, 0.0)"""
+        if self.spec_index is None:
+            return None, 0.0
+        return self.spec_index.lookup(make, model, year, trim)
+    
+    def _request_car_specifications(self, make, model, year=None, trim=None):
+        """Запрос характеристик у Gemini (без кэша и без fallback)"""
+        query = self._build_spec_query(make, model, year, trim)
             
         prompt = f"""
 Ты автомобильный эксперт. Найди точные официальные технические характеристики автомобиля: {query}
 
 Верни информацию СТРОГО в JSON формате (без markdown, без дополнительного текста):
-{{
-    "make": "Марка автомобиля (точное официальное название)",
-    "model": "Модель (точное официальное название)",
-    "year_range": "Год или диапазон годов производства этого поколения (например: 2020-2024 или 2023)",
-    "engine": "Двигатель - объем и тип (формат: 3.0L Twin-Turbo I6)",
-    "power": "Мощность в лошадиных силах (формат: 503 HP)",
-    "torque": "Крутящий момент (формат: 650 Nm)",
-    "weight": "Снаряженная масса (формат: 1725 kg)",
-    "acceleration": "Разгон 0-100 км/ч (формат: 3.9 s)",
-    "top_speed": "Максимальная скорость (формат: 250 km/h)",
-    "country_code": "Двухбуквенный ISO код страны производителя (DE-Германия, US-США, JP-Япония, IT-Италия, GB-Великобритания, FR-Франция, KR-Корея, SE-Швеция, CZ-Чехия)"
-}}
+{SPEC_JSON_SCHEMA}
 
 ВАЖНО: Используй только официальные данные производителя. Если это конкретная версия/комплектация, используй её характеристики.
 """
         
-        try:
-            # Используем более дешевую модель gemini-2.0-flash-exp для поиска характеристик
-            response = self.client.models.generate_content(
-                model='gemini-2.0-flash-exp',
-                contents=prompt
-            )
+        # Используем более дешевую модель gemini-2.0-flash-exp для поиска характеристик
+        response = self.gemini.generate_content(
+            model=self.spec_model,
+            contents=prompt
+        )
+        
+        specs = self._parse_json_response(response.text)
+        # Неполный ответ не должен попасть в кэш: считаем его ошибкой API
+        missing = [field for field in SPEC_FIELDS if not isinstance(specs, dict) or not specs.get(field)]
+        if missing:
+            raise ValueError(f"В ответе нет полей: {', '.join(missing)}")
+        specs = {field: specs[field] for field in SPEC_FIELDS}
+        print("✅ Характеристики найдены успешно")
+        print(f"   Двигатель: {specs.get('engine')}")
+        print(f"   Мощность: {specs.get('power')}")
+        print(f"   Разгон: {specs.get('acceleration')}")
+        return specs
+    
+    def search_car_specifications_bulk(self, cars, chunk_size=None, use_cache=True, refresh_cache=False):
+        """
+        Поиск характеристик для нескольких автомобилей одним запросом на пачку
+        
+        cars - список словарей с ключами make, model, year, trim
+        Возвращает список характеристик в том же порядке.
+        Пропущенные или битые записи запрашиваются повторно по одной.
+        """
+        # SPEC_BULK_CHUNK_SIZE=0 в пакетном режиме значит "по одному", здесь это размер по умолчанию
+        if not chunk_size or chunk_size <= 0:
+            chunk_size = int(os.getenv('SPEC_BULK_CHUNK_SIZE', 0))
+        if chunk_size <= 0:
+            chunk_size = DEFAULT_SPEC_BULK_CHUNK_SIZE
+        cache = self.spec_cache if use_cache else None
+        results = [None] * len(cars)
+        
+        pending = []
+        for index, car in enumerate(cars):
+            index_specs, index_score = self._lookup_spec_index(car['make'], car['model'], car.get('year'), car.get('trim'))
+            if index_score >= self.spec_index_min_score:
+                results[index] = index_specs
+                continue
+            if cache is not None and not refresh_cache:
+                cached = cache.get(car['make'], car['model'], car.get('year'), car.get('trim'))
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            pending.append(index)
+        
+        if len(pending) < len(cars):
+            print(f"⚡ Из локального индекса и кэша: {len(cars) - len(pending)} из {len(cars)}")
+        
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            print(f"🔍 Поиск характеристик пачкой: {len(chunk)} автомобилей...")
             
-            specs_text = response.text.strip()
-            # Очистка от markdown
-            specs_text = specs_text.replace('```json', '').replace('```', '').strip()
-            specs = json.loads(specs_text)
-            print("✅ Характеристики найдены успешно")
-            print(f"   Двигатель: {specs.get('engine')}")
-            print(f"   Мощность: {specs.get('power')}")
-            print(f"   Разгон: {specs.get('acceleration')}")
-            return specs
+            try:
+                found = self._request_car_specifications_bulk([cars[i] for i in chunk])
+            except Exception as e:
+                print(f"⚠️ Ошибка пакетного поиска характеристик: {e}")
+                found = [None] * len(chunk)
             
-        except Exception as e:
-            print(f"⚠️ Ошибка поиска характеристик: {e}")
-            print("📋 Использую базовые характеристики...")
-            return self._get_default_specs(make, model, year)
+            for index, specs in zip(chunk, found):
+                car = cars[index]
+                if specs is None:
+                    # Повтор по одной - внутри будет fallback на базовые характеристики
+                    results[index] = self.search_car_specifications(
+                        car['make'], car['model'], car.get('year'), car.get('trim'),
+                        use_cache=use_cache, refresh_cache=True
+                    )
+                    continue
+                if cache is not None:
+                    cache.put(car['make'], car['model'], car.get('year'), car.get('trim'), specs)
+                results[index] = specs
+            
+            ok = sum(1 for specs in found if specs is not None)
+            print(f"✅ Найдено в пачке: {ok} из {len(chunk)}")
+        
+        return results
+    
+    def _request_car_specifications_bulk(self, cars):
+        """
+        Один запрос к Gemini на список автомобилей.
+        Возвращает список той же длины: характеристики или None для пропущенных записей.
+        """
+        queries = '\n'.join(
+            f"{number}. {self._build_spec_query(car['make'], car['model'], car.get('year'), car.get('trim'))}"
+            for number, car in enumerate(cars, start=1)
+        )
+        
+        prompt = f"""
+Ты автомобильный эксперт. Найди точные официальные технические характеристики для каждого автомобиля из списка:
+{queries}
+
+Верни СТРОГО JSON массив (без markdown, без дополнительного текста) из {len(cars)} объектов в том же порядке.
+Каждый объект содержит поле "index" (номер автомобиля в списке) и поля по схеме:
+{SPEC_JSON_SCHEMA}
+
+ВАЖНО: Используй только официальные данные производителя. Если это конкретная версия/комплектация, используй её характеристики.
+"""
+        
+        response = self.gemini.generate_content(
+            model=self.spec_model,
+            contents=prompt
+        )
+        
+        entries = self._parse_json_response(response.text)
+        if not isinstance(entries, list):
+            raise ValueError("Ожидался JSON массив характеристик")
+        
+        found = [None] * len(cars)
+        for position, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                continue
+            # Номер из ответа надежнее позиции, если модель пропустила запись
+            number = entry.pop('index', position + 1)
+            try:
+                slot = int(number) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= slot < len(cars) and found[slot] is None and all(entry.get(field) for field in SPEC_FIELDS):
+                found[slot] = {field: entry[field] for field in SPEC_FIELDS}
+        return found
+    
+    def _build_spec_query(self, make, model, year=None, trim=None):
+        """Строка запроса: марка модель [год] [комплектация]"""
+        query = f"{make} {model}"
+        if year:
+            query += f" {year}"
+        if trim:
+            query += f" {trim}"
+        return query
+    
+    def _parse_json_response(self, text):
+        """Разбор JSON из ответа модели с очисткой от markdown"""
+        text = text.strip().replace('```json', '').replace('```', '').strip()
+        return json.loads(text)
     
     def _get_default_specs(self, make, model, year):
         """Базовые характеристики на случай ошибки API"""
@@ -110,141 +441,46 @@ class CarPosterGenerator:
         flag = ''.join(chr(127397 + ord(char)) for char in code)
         return flag
     
-    def generate_poster_prompt(self, specs, color=None):
+    def generate_poster_prompt(self, specs, color=None, variant=None):
         """
-        Создание профессионального промпта для генерации постера
-        Промпт разработан как prompt engineer для максимальной точности
+        Создание промпта для генерации постера по шаблону из prompts/
+        (variant: verbose - подробный, compact - короткий; по умолчанию PROMPT_VARIANT)
         """
-        
-        make = specs['make']
-        model = specs['model']
-        year = specs['year_range']
-        engine = specs['engine']
-        power = specs['power']
-        torque = specs['torque']
-        weight = specs['weight']
-        acceleration = specs['acceleration']
-        top_speed = specs['top_speed']
-        country_code = specs['country_code']
-        flag_emoji = self.get_country_flag_emoji(country_code)
-        
+        template = self.poster_template if variant is None else load_template('poster', variant)
         color_description = f"в {color} цвете" if color else "в элегантном темном цвете"
         
-        prompt = f"""
-ЗАДАЧА: Создай автомобильный постер ТОЧНО по референсному изображению, заменив только автомобиль и технические данные.
-
-═══════════════════════════════════════════════════════════════════════════
-АВТОМОБИЛЬ ДЛЯ ПОСТЕРА:
-═══════════════════════════════════════════════════════════════════════════
-Марка и модель: {make} {model}
-Год: {year}
-Цвет: {color_description}
-
-═══════════════════════════════════════════════════════════════════════════
-КОМПОЗИЦИЯ И СТРУКТУРА (СТРОГО КАК НА РЕФЕРЕНСЕ):
-═══════════════════════════════════════════════════════════════════════════
-
-ФОРМАТ:
-• Вертикальный постер, соотношение сторон примерно 3:4
-• Минималистичный, профессиональный дизайн
-• Светлый нейтральный фон (#F5F5F5 или подобный)
-
-ВЕРХНЯЯ ЧАСТЬ (ТЕКСТОВЫЙ БЛОК):
-• Марка автомобиля: "{make.upper()}" - крупный жирный шрифт, темно-серый цвет (#333333)
-• Модель автомобиля: "{model.upper()}" - очень крупный жирный шрифт, черный цвет (#000000)
-• Расположение: левый верхний угол постера, с отступом от края
-
-ЦЕНТРАЛЬНАЯ ЧАСТЬ (ИЗОБРАЖЕНИЕ АВТОМОБИЛЯ):
-• Профессиональная фотография {make} {model} {color_description}
-• Ракурс: три четверти спереди (front 3/4 view)
-• Освещение: студийное, мягкое, равномерное
-• Фон за автомобилем: чистый белый или светло-серый градиент
-• Стиль: как в автомобильном шоу-руме или маркетинговых материалах премиум-класса
-• Автомобиль занимает центральную часть постера
-• Тени: тонкие, реалистичные под автомобилем
-• Качество: фотореалистичное, высокое разрешение
-
-НИЖНЯЯ ЧАСТЬ (ТЕХНИЧЕСКИЕ ХАРАКТЕРИСТИКИ):
-Расположи характеристики в виде организованной сетки под изображением автомобиля:
-
-ЛЕВАЯ КОЛОНКА:
-• "YEAR" (заголовок) - жирным
-• "{year}" (значение) - под заголовком
-
-СРЕДНЯЯ КОЛОНКА (характеристики в столбик):
-• "Engine" (серый текст) → "{engine}" (черный текст)
-• "Power" (серый текст) → "{power}" (черный текст)
-• "Torque" (серый текст) → "{torque}" (черный текст)
-• "Weight" (серый текст) → "{weight}" (черный текст)
-
-ПРАВАЯ КОЛОНКА:
-• "0-100 km/h" (серый текст) → "{acceleration}" (черный текст)
-• "Top speed" (серый текст) → "{top_speed}" (черный текст)
-
-ФЛАГ СТРАНЫ:
-• В правом нижнем углу постера: флаг {flag_emoji} (страна: {country_code})
-
-═══════════════════════════════════════════════════════════════════════════
-КРИТИЧЕСКИЕ ТРЕБОВАНИЯ К СТИЛЮ:
-═══════════════════════════════════════════════════════════════════════════
-
-ТИПОГРАФИКА:
-✓ Используй современные sans-serif шрифты (как Helvetica, Arial, или подобные)
-✓ Четкая иерархия размеров: марка (большой) → модель (очень большой) → характеристики (средний)
-✓ Идеальное выравнивание и интервалы между элементами
-✓ ВСЕ ЦИФРЫ И ТЕКСТ ДОЛЖНЫ БЫТЬ АБСОЛЮТНО ТОЧНЫМИ - без ошибок и опечаток
-
-ЦВЕТОВАЯ СХЕМА:
-✓ Фон: светлый нейтральный (#F5F5F5)
-✓ Заголовки марки/модели: темно-серый и черный
-✓ Лейблы характеристик: средне-серый (#666666)
-✓ Значения характеристик: черный (#000000)
-✓ Общий стиль: минималистичный, премиум, профессиональный
-
-ИЗОБРАЖЕНИЕ АВТОМОБИЛЯ:
-✓ {make} {model} {year} {color_description}
-✓ Фотореалистичное качество
-✓ Студийное освещение, без резких теней
-✓ Ракурс: передние три четверти (показывает переднюю часть и сбоку)
-✓ Автомобиль четко в фокусе
-✓ Чистый фон без отвлекающих элементов
-✓ Как в официальных пресс-фото производителя
-
-ТОЧНОСТЬ ДАННЫХ:
-✓ Марка: {make.upper()}
-✓ Модель: {model.upper()}
-✓ Год: {year}
-✓ Двигатель: {engine}
-✓ Мощность: {power}
-✓ Момент: {torque}
-✓ Масса: {weight}
-✓ 0-100: {acceleration}
-✓ Макс.скорость: {top_speed}
-✓ Флаг: {flag_emoji}
-
-═══════════════════════════════════════════════════════════════════════════
-ЗАПРЕЩЕНО:
-═══════════════════════════════════════════════════════════════════════════
-✗ Любые логотипы или водяные знаки
-✗ Дополнительный текст, не указанный выше
-✗ Размытые или нечеткие изображения
-✗ Неправильные или выдуманные характеристики
-✗ Опечатки в тексте или цифрах
-✗ Искаженные пропорции автомобиля
-✗ Отклонения от референсной композиции
-
-═══════════════════════════════════════════════════════════════════════════
-ФИНАЛЬНЫЙ РЕЗУЛЬТАТ:
-═══════════════════════════════════════════════════════════════════════════
-Профессиональный автомобильный постер в стиле премиум-маркетинга,
-который мог бы использоваться дилером или производителем автомобилей.
-Чистый, элегантный, информативный дизайн с фокусом на автомобиль и
-точные технические данные.
-
-СТРОГО СЛЕДУЙ КОМПОЗИЦИИ РЕФЕРЕНСНОГО ИЗОБРАЖЕНИЯ!
-"""
-        
-        return prompt
+        return template.render(
+            make=specs['make'],
+            model=specs['model'],
+            make_upper=specs['make'].upper(),
+            model_upper=specs['model'].upper(),
+            year=specs['year_range'],
+            engine=specs['engine'],
+            power=specs['power'],
+            torque=specs['torque'],
+            weight=specs['weight'],
+            acceleration=specs['acceleration'],
+            top_speed=specs['top_speed'],
+            country_code=specs['country_code'],
+            flag_emoji=self.get_country_flag_emoji(specs['country_code']),
+            color_description=color_description,
+        )
+    
+    def count_prompt_tokens(self, prompt):
+        """Токены промпта: PROMPT_TOKEN_COUNT=api - через count_tokens, иначе локальная оценка"""
+        if self.prompt_token_count == 'api':
+            return count_tokens(prompt, self.gemini.client, self.image_model)
+        return count_tokens(prompt)
+    
+    def _check_prompt_budget(self, template, tokens):
+        # Предупреждение один раз на шаблон, чтобы не засорять лог пакетной генерации
+        if not self.prompt_token_budget or tokens <= self.prompt_token_budget:
+            return
+        key = (template.name, template.variant)
+        if key not in self._prompt_budget_warned:
+            self._prompt_budget_warned.add(key)
+            print(f"⚠️ Промпт {template.name}.{template.variant}: {tokens} токенов, "
+                  f"бюджет {self.prompt_token_budget} (PROMPT_TOKEN_BUDGET)")
     
     def generate_poster(self, make, model, year=None, trim=None, color=None, output_path=None):
         """Генерация полного постера через Gemini AI"""
@@ -256,53 +492,88 @@ class CarPosterGenerator:
         # Шаг 1: Получить характеристики автомобиля
         specs = self.search_car_specifications(make, model, year, trim)
         
+        return self.generate_poster_from_specs(specs, make, model, year, color, output_path, trim=trim)
+    
+    def generate_poster_from_specs(self, specs, make, model, year=None, color=None, output_path=None, trim=None):
+        """Генерация постера по уже найденным характеристикам (шаги 2-4)"""
+        
+        if self.poster_mode == 'hybrid':
+            return self.generate_hybrid_poster(specs, make, model, year, color, output_path, trim=trim)
+        
         # Шаг 2: Создать промпт для генерации постера
         print("\n📝 Создание промпта для AI-генерации...")
-        prompt = self.generate_poster_prompt(specs, color)
+        with self.metrics.stage('prompt_build', template='poster', outcome=self.poster_template.variant) as event:
+            prompt = self.generate_poster_prompt(specs, color)
+            tokens, token_source = self.count_prompt_tokens(prompt)
+            event.update(chars=len(prompt), prompt_tokens=tokens, token_source=token_source)
+        print(f"📏 Промпт ({self.poster_template.variant}): {len(prompt)} символов, ~{tokens} токенов")
+        self._check_prompt_budget(self.poster_template, tokens)
         
         # Шаг 3: Генерация постера через Gemini 3 Pro Image Preview (Nano Banana Pro)
         print("\n🎨 Генерация постера через Gemini 3 Pro Image (Nano Banana Pro)...")
-        print("⏳ Это может занять 10-30 секунд...")
         
         try:
-            # Используем gemini-3-pro-image-preview для генерации изображения
-            response = self.client.models.generate_content(
-                model='gemini-3-pro-image-preview',
-                contents=[prompt, self.reference_image],
-                config=types.GenerateContentConfig(
-                    response_modalities=['TEXT', 'IMAGE'],
-                    temperature=0.3,
-                )
-            )
+            if not output_path:
+                output_path = self._default_output_path(make, model, year, specs)
             
-            print("📥 Получен ответ от Gemini API...")
+            cache_key = None
+            if self.poster_cache is not None:
+                with self.metrics.stage('poster_cache_lookup') as event:
+                    cache_key = self.poster_cache.make_key(
+                        prompt, self.reference.data, self.image_model, self._image_generation_config()
+                    )
+                    cached_path = self.poster_cache.get(cache_key)
+                    event['outcome'] = 'miss' if cached_path is None else 'hit'
+                if cached_path is not None:
+                    print("⚡ Такой постер уже генерировался - берем из кэша без запроса к API")
+                    self._export_cached_poster(cached_path, output_path)
+                    self._submit_derivatives(str(cached_path), output_path)
+                    print(f"\n✅ ПОСТЕР СОХРАНЕН: {output_path}")
+                    print(f"{'='*70}\n")
+                    return str(output_path)
             
-            # Извлекаем сгенерированное изображение
-            poster_image = None
-            for part in response.parts:
-                if part.text is not None:
-                    print(f"📝 Комментарий AI: {part.text[:200]}...")
-                elif part.inline_data is not None:
-                    poster_image = part.as_image()
-                    print("✅ Постер успешно сгенерирован!")
-                    break
+            print("⏳ Это может занять 10-30 секунд...")
+            
+            # Используем gemini-3-pro-image-preview для генерации изображения
+            with self.metrics.stage('image_request', model=self.image_model) as event:
+                event['bytes_in'] = len(prompt.encode('utf-8')) + self.reference.payload_bytes
+                image_data = self._request_image([prompt, self.reference_part])
+                event['bytes_out'] = len(image_data.data) if image_data is not None else 0
             
-            if poster_image is None:
+            if image_data is None:
                 raise ValueError("Не удалось извлечь изображение из ответа API")
             
+            if cache_key is not None:
+                self.poster_cache.put(cache_key, image_data.data, image_data.mime_type)
+            
             # Шаг 4: Сохранение постера
+            self._write_poster_bytes(image_data.data, image_data.mime_type, output_path)
+            self._submit_derivatives(image_data.data, output_path)
+            
+            print(f"\n✅ ПОСТЕР СОХРАНЕН: {output_path}")
+            print(f"{'='*70}\n")
+            
+            return str(output_path)
+            
+        except Exception as e:
+            print(f"\n❌ ОШИБКА ГЕНЕРАЦИИ: {e}")
+            print(f"Тип ошибки: {type(e).__name__}")
+            raise
+    
+    def generate_hybrid_poster(self, specs, make, model, year=None, color=None, output_path=None,
+                               language=None, size=None, trim=None):
+        """
+        Гибридный постер: AI-рендер автомобиля (кэшируется по марке/модели/комплектации/году/цвету)
+        плюс локальная верстка текста. Исправление характеристик, другой язык или размер
+        не требуют нового запроса к API.
+        """
+        try:
             if not output_path:
-                output_dir = Path(self.output_directory)
-                output_dir.mkdir(exist_ok=True)
-                filename = f"{make}_{model}_{year or specs['year_range']}.{self.output_format}"
-                output_path = output_dir / filename
+                output_path = self._default_output_path(make, model, year, specs)
             
-            # Сохранение в нужном формате
-            if self.output_format == 'jpg':
-                poster_image = poster_image.convert('RGB')
-                poster_image.save(output_path, 'JPEG', quality=95, optimize=True)
-            else:
-                poster_image.save(output_path, 'PNG', optimize=True)
+            car_image = self.get_car_render(make, model, year or specs['year_range'], color, trim=trim)
+            self.compose_poster(specs, car_image, output_path, language, size)
+            self._submit_derivatives(str(output_path), output_path)
             
             print(f"\n✅ ПОСТЕР СОХРАНЕН: {output_path}")
             print(f"{'='*70}\n")
@@ -314,6 +585,157 @@ class CarPosterGenerator:
             print(f"Тип ошибки: {type(e).__name__}")
             raise
     
+    def compose_poster(self, specs, car_image, output_path, language=None, size=None):
+        """Локальная верстка постера поверх готового рендера автомобиля"""
+        print("\n🖋 Верстка текста и характеристик...")
+        with self.metrics.stage('compose') as event:
+            import poster_layout
+            poster_image = poster_layout.compose_poster(car_image, specs, language or self.poster_language, size)
+            event['size'] = f"{poster_image.width}x{poster_image.height}"
+        self._save_poster_image(poster_image, output_path)
+        return str(output_path)
+    
+    def generate_car_render_prompt(self, make, model, year, color=None, trim=None):
+        """Промпт для рендера только автомобиля, без текста и оформления"""
+        color_description = f"в {color} цвете" if color else "в элегантном темном цвете"
+        name = ' '.join(str(part) for part in (make, model, trim, year) if part)
+        return f"""
+Профессиональная студийная фотография автомобиля {name} {color_description}.
+• Ракурс: три четверти спереди (front 3/4 view), автомобиль целиком в кадре
+• Фон: однородный светлый нейтральный #F5F5F5, без градиентов и предметов
+• Освещение: студийное, мягкое; тонкие реалистичные тени под автомобилем
+• Фотореалистичное качество, как в официальных пресс-фото производителя
+• Горизонтальный кадр, соотношение сторон примерно 16:9
+✗ Никакого текста, цифр, логотипов, водяных знаков и флагов
+"""
+    
+    def get_car_render(self, make, model, year, color=None, refresh=False, trim=None):
+        """Рендер автомобиля: из кэша по марке/модели/комплектации/году/цвету или новый запрос к API"""
+        if self.car_render_cache is None:
+            self.car_render_cache = PosterCache(os.getenv('CAR_RENDER_CACHE_DIR', 'cache/car_renders'))
+        
+        color_key = ' '.join(str(color or '').lower().split())
+        cache_key = hashlib.sha256(
+            f"{SpecCache.make_key(make, model, year, trim)}|{color_key}|{self.image_model}".encode('utf-8')
+        ).hexdigest()
+        
+        if not refresh:
+            with self.metrics.stage('car_render_cache_lookup') as event:
+                cached_path = self.car_render_cache.get(cache_key)
+                event['outcome'] = 'miss' if cached_path is None else 'hit'
+            if cached_path is not None:
+                print("⚡ Рендер автомобиля взят из кэша")
+                from PIL import Image
+                return Image.open(cached_path)
+        
+        print(f"\n🎨 Рендер автомобиля через Gemini 3 Pro Image: {make} {model} {trim or ''} {year}...")
+        print("⏳ Это может занять 10-30 секунд...")
+        prompt = self.generate_car_render_prompt(make, model, year, color, trim)
+        with self.metrics.stage('image_request', model=self.image_model) as event:
+            event['bytes_in'] = len(prompt.encode('utf-8'))
+            image_data = self._request_image([prompt])
+            event['bytes_out'] = len(image_data.data) if image_data is not None else 0
+        
+        if image_data is None:
+            raise ValueError("Не удалось извлечь изображение из ответа API")
+        
+        self.car_render_cache.put(cache_key, image_data.data, image_data.mime_type)
+        from PIL import Image
+        return Image.open(BytesIO(image_data.data))
+    
+    def _request_image(self, contents):
+        """Запрос изображения (с дублированием, если включено); возвращает inline_data или None"""
+        from google.genai import types
+        
+        def request_image():
+            return self.gemini.generate_content(
+                model=self.image_model,
+                contents=contents,
+                config=types.GenerateContentConfig(**self._image_generation_config())
+            )
+        
+        if self.hedger is not None:
+            return self.hedger.call(request_image, self._extract_image_data)
+        return self._extract_image_data(request_image())
+    
+    def _extract_image_data(self, response):
+        """Извлекаем сгенерированное изображение (inline_data) или None"""
+        print("📥 Получен ответ от Gemini API...")
+        with self.metrics.stage('response_parse') as event:
+            event['outcome'] = 'no_image'
+            for part in response.parts or []:
+                if part.text is not None:
+                    print(f"📝 Комментарий AI: {part.text[:200]}...")
+                elif part.inline_data is not None:
+                    print("✅ Постер успешно сгенерирован!")
+                    event['outcome'] = 'image'
+                    return part.inline_data
+        return None
+    
+    def collect_derivatives(self, poster_paths=None):
+        """Ожидание производных версий (всех или только poster_paths); {путь постера: манифест файлов}"""
+        if self.derivative_pipeline is None:
+            return {}
+        return self.derivative_pipeline.collect(poster_paths)
+    
+    def _submit_derivatives(self, source, output_path):
+        """Фоновое создание производных версий, не блокирует следующий запрос"""
+        if self.derivative_pipeline is not None:
+            self.derivative_pipeline.submit(source, output_path)
+            print(f"🖼 Производные версии поставлены в очередь: {len(self.derivative_pipeline.derivatives)}")
+    
+    def _image_generation_config(self):
+        """Настройки генерации постера (словарь для GenerateContentConfig и ключа кэша)"""
+        return {
+            'response_modalities': ['TEXT', 'IMAGE'],
+            'temperature': self.image_temperature,
+        }
+    
+    def _default_output_path(self, make, model, year, specs):
+        """Путь по умолчанию: OUTPUT_DIRECTORY/Марка_Модель_Год.формат"""
+        output_dir = Path(self.output_directory)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        filename = f"{make}_{model}_{year or specs['year_range']}.{self.output_format}"
+        return output_dir / filename
+    
+    def _export_cached_poster(self, cached_path, output_path):
+        """Копия постера из кэша; перекодирование только если формат отличается"""
+        if self.output_passthrough and cached_path.suffix.lstrip('.').lower() == self.output_format:
+            shutil.copyfile(cached_path, output_path)
+        else:
+            from PIL import Image
+            with Image.open(cached_path) as cached_image:
+                self._save_poster_image(cached_image, output_path)
+    
+    def _write_poster_bytes(self, data, mime_type, output_path):
+        """Запись байтов из ответа API: напрямую, если формат совпадает, иначе через перекодирование"""
+        if self.output_passthrough and MIME_EXTENSIONS.get(mime_type) == self.output_format:
+            self._write_file(data, output_path, outcome='passthrough')
+            return
+        from PIL import Image
+        with Image.open(BytesIO(data)) as poster_image:
+            self._save_poster_image(poster_image, output_path)
+    
+    def _save_poster_image(self, poster_image, output_path):
+        """Сохранение постера в формате self.output_format"""
+        with self.metrics.stage('encode', format=self.output_format) as event:
+            buffer = BytesIO()
+            if self.output_format == 'jpg':
+                poster_image = poster_image.convert('RGB')
+                poster_image.save(buffer, 'JPEG', quality=95, optimize=True)
+            elif self.png_optimize:
+                poster_image.save(buffer, 'PNG', optimize=True)
+            else:
+                poster_image.save(buffer, 'PNG', compress_level=self.png_compress_level)
+            event['bytes_out'] = buffer.tell()
+        self._write_file(buffer.getbuffer(), output_path, outcome='reencode')
+    
+    def _write_file(self, data, output_path, outcome):
+        """Запись готовых байтов постера на диск"""
+        with self.metrics.stage('disk_write', outcome=outcome) as event:
+            Path(output_path).write_bytes(data)
+            event['bytes_out'] = len(data)
+    
     # Алиас для обратной совместимости
     create_poster = generate_poster
 
@@ -359,6 +781,15 @@ def main():
     # Генерируем первый пример
     result = generator.generate_poster(**examples[0])
     print(f"\n🎉 Готово! Файл: {result}")
+    
+    manifest = generator.collect_derivatives().get(result, [])
+    if not isinstance(manifest, list):
+        print(f"⚠️ Производные версии не созданы: {manifest.get('error')}")
+        manifest = []
+    for derivative in manifest:
+        print(f"   🖼 {derivative['name']}: {derivative['path']} ({derivative['width']}x{derivative['height']})")
+    
+    generator.metrics.write_prometheus()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+# Производные версии постера по умолчанию
+# size - (ширина, высота) или None для исходного размера
+# mode - fit (вписать с сохранением пропорций) или crop (обрезать точно в размер)
+DEFAULT_DERIVATIVES = [
+    {"name": "thumb", "size": [400, 400], "mode": "fit", "format": "webp", "quality": 80},
+    {"name": "social", "size": [1080, 1080], "mode": "crop", "format": "jpg", "quality": 85},
+    {"name": "print", "size": None, "mode": "fit", "format": "jpg", "quality": 95},
+]
+
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+}
+
+
+def load_derivatives_config(path=None):
+    """Список производных версий из JSON файла или значения по умолчанию"""
+    if not path:
+        return DEFAULT_DERIVATIVES
+    with open(path, encoding='utf-8') as f:
+        derivatives = json.load(f)
+    for derivative in derivatives:
+        if derivative.get('format', 'jpg').lower() not in PIL_FORMATS:
+            raise ValueError(f"Неподдерживаемый формат производной версии: {derivative.get('format')}")
+    return derivatives
+
+
+def render_derivatives(source, poster_path, derivatives):
+    """
+    Создание всех производных версий из одного декодированного изображения.
+    source - байты изображения или путь к файлу.
+    Возвращает манифест записанных файлов.
+    """
+    poster_path = Path(poster_path)
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+
+    manifest = []
+    with Image.open(source) as image:
+        image.load()
+        for derivative in derivatives:
+            extension = derivative.get('format', 'jpg').lower()
+            pil_format = PIL_FORMATS[extension]
+            size = derivative.get('size')
+
+            if size and derivative.get('mode') == 'crop':
+                result = ImageOps.fit(image, tuple(size), Image.LANCZOS)
+            elif size:
+                result = image.copy()
+                result.thumbnail(tuple(size), Image.LANCZOS)
+            else:
+                result = image
+
+            params = {}
+            if pil_format == 'JPEG':
+                result = result.convert('RGB')
+                params = {'quality': derivative.get('quality', 90), 'optimize': True}
+            elif pil_format == 'WEBP':
+                params = {'quality': derivative.get('quality', 80), 'method': derivative.get('method', 4)}
+            else:
+                params = {'compress_level': derivative.get('compress_level', 6)}
+
+            path = poster_path.with_name(f"{poster_path.stem}_{derivative['name']}.{extension}")
+            result.save(path, pil_format, **params)
+            manifest.append({
+                "name": derivative['name'],
+                "path": str(path),
+                "format": extension,
+                "width": result.width,
+                "height": result.height,
+                "bytes": path.stat().st_size,
+            })
+    return manifest
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class DerivativePipeline:
+    """
+    Кодирование производных версий в пуле процессов,
+    чтобы сжатие шло параллельно со следующим запросом к API.
+    """
+
+    def __init__(self, derivatives=None, max_workers=None):
+        self.derivatives = derivatives or DEFAULT_DERIVATIVES
+        self.max_workers = max_workers or int(os.getenv('DERIVATIVE_WORKERS', 0)) or None
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, source, poster_path):
+        """Постановка постера в очередь; возвращает Future с манифестом"""
+        with self._lock:
+            if self._executor is None:
+                # Пул создается из рабочего потока многопоточного процесса: fork в такой момент
+                # может унаследовать захваченные блокировки, поэтому процессы стартуют через forkserver
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_mp_context())
+            future = self._executor.submit(render_derivatives, source, str(poster_path), self.derivatives)
+            self._pending[str(poster_path)] = future
+        return future
+
+    def collect(self, poster_paths=None):
+        """
+        Ожидание поставленных задач; {путь постера: манифест или ошибка}.
+        poster_paths - только эти постеры (остальные задачи остаются в очереди).
+        """
+        with self._lock:
+            if poster_paths is None:
+                pending, self._pending = self._pending, {}
+            else:
+                pending = {}
+                for poster_path in map(str, poster_paths):
+                    if poster_path in self._pending:
+                        pending[poster_path] = self._pending.pop(poster_path)
+
+        manifests = {}
+        for poster_path, future in pending.items():
+            try:
+                manifests[poster_path] = future.result()
+            except Exception as e:
+                print(f"⚠️ Ошибка создания производных версий {poster_path}: {e}")
+                manifests[poster_path] = {"error": f"{type(e).__name__}: {e}"}
+        return manifests
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
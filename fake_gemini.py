@@ -0,0 +1,142 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from io import BytesIO
+
+from google.genai import errors, types
+from PIL import Image
+
+# Характеристики, которые возвращает имитация поиска
+FAKE_SPECS = {
+    "year_range": "2021-2024",
+    "engine": "3.0L Twin-Turbo I6",
+    "power": "503 HP",
+    "torque": "650 Nm",
+    "weight": "1725 kg",
+    "acceleration": "3.9 s",
+    "top_speed": "250 km/h",
+    "country_code": "DE",
+}
+
+
+class LatencyModel:
+    """Логнормальная задержка: медиана и разброс (sigma), масштаб для ускоренных прогонов"""
+
+    def __init__(self, median, sigma=0.5, scale=1.0):
+        self.median = median
+        self.sigma = sigma
+        self.scale = scale
+
+    def sample(self, rng):
+        return self.median * math.exp(rng.gauss(0, self.sigma)) * self.scale
+
+
+def make_image_payload(width, height, image_format='PNG', seed=0):
+    """
+    Синтетический постер реалистичного размера:
+    плавный фон плюс шум, чтобы PNG сжимался примерно как настоящее фото.
+    """
+    rng = random.Random(seed)
+    background = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    image = Image.blend(background, noise, 0.08)
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        return self._client._generate(model, contents, config)
+
+
+class FakeGeminiClient:
+    """
+    Локальная замена genai.Client для тестов и бенчмарков без сети и квоты.
+    Имитирует client.models.generate_content: задержки, ошибки 429/5xx,
+    ответы только с текстом и изображения inline_data реалистичного размера.
+    """
+
+    def __init__(self, spec_latency=None, image_latency=None, rate_limit_rate=0.0, server_error_rate=0.0,
+                 text_only_rate=0.0, image_size=(1024, 1365), image_mime_type='image/png', seed=0,
+                 latency_scale=1.0):
+        self.spec_latency = spec_latency or LatencyModel(1.5, 0.4, latency_scale)
+        self.image_latency = image_latency or LatencyModel(20.0, 0.35, latency_scale)
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.text_only_rate = text_only_rate
+        self.image_mime_type = image_mime_type
+
+        # Изображение генерируется один раз, чтобы не тратить CPU бенчмарка на имитацию
+        image_format = 'JPEG' if image_mime_type == 'image/jpeg' else 'PNG'
+        self.image_bytes = make_image_payload(*image_size, image_format=image_format, seed=seed)
+
+        self.models = _FakeModels(self)
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _generate(self, model, contents, config):
+        with self._lock:
+            self.calls += 1
+            is_image = 'image' in model
+            delay = (self.image_latency if is_image else self.spec_latency).sample(self._rng)
+        time.sleep(delay)
+
+        roll = self._roll()
+        if roll < self.rate_limit_rate:
+            raise errors.ClientError(429, {'error': {
+                'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': 'Fake quota exceeded',
+                'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '0.1s'}],
+            }})
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            raise errors.ServerError(503, {'error': {'code': 503, 'status': 'UNAVAILABLE', 'message': 'Fake overload'}})
+
+        prompt = contents if isinstance(contents, str) else next((c for c in contents if isinstance(c, str)), '')
+        prompt_tokens = len(prompt) // 4 + (0 if isinstance(contents, str) else 258)
+
+        if not is_image:
+            text = json.dumps(self._fake_specs(prompt), ensure_ascii=False)
+            parts = [types.Part(text=text)]
+            response_tokens = len(text) // 4
+        elif self._roll() < self.text_only_rate:
+            parts = [types.Part(text="Не могу сгенерировать изображение по этому запросу.")]
+            response_tokens = 20
+        else:
+            parts = [
+                types.Part(text="Вот постер."),
+                types.Part(inline_data=types.Blob(data=self.image_bytes, mime_type=self.image_mime_type)),
+            ]
+            response_tokens = 1290
+
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role='model', parts=parts))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=response_tokens,
+                total_token_count=prompt_tokens + response_tokens,
+            ),
+        )
+
+    def _fake_specs(self, prompt):
+        """Ответ на одиночный или пакетный запрос характеристик"""
+        numbered = re.findall(r'^(\d+)\. (\S+) (.+)$', prompt, flags=re.MULTILINE)
+        if numbered:
+            return [
+                {"index": int(number), "make": make, "model": model, **FAKE_SPECS}
+                for number, make, model in numbered
+            ]
+        match = re.search(r'автомобиля: (\S+) (.+)', prompt)
+        make, model = match.groups() if match else ('Fake', 'Car')
+        return {"make": make, "model": model, **FAKE_SPECS}
+
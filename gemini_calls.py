@@ -0,0 +1,281 @@
+import os
+import random
+import sys
+import threading
+import time
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+# Примерная стоимость изображения во входных токенах
+IMAGE_TOKEN_ESTIMATE = 258
+
+
+class TokenBucket:
+    """Ведро токенов: rate_per_minute единиц в минуту, 0 - без ограничения"""
+
+    def __init__(self, rate_per_minute):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = float(rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_minute / 60.0)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """Ожидание нужного количества токенов; возвращает время ожидания в секундах"""
+        if not self.rate_per_minute:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) * 60.0 / self.rate_per_minute
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """Поправка после ответа: положительное значение списывает токены, отрицательное возвращает"""
+        if not self.rate_per_minute:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Потолок параллельных запросов, подстраивающийся под ошибки (AIMD):
+    при троттлинге потолок делится пополам, при успехах медленно растет до максимума.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = float(max_limit) if max_limit else 0.0
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        if not self.max_limit:
+            return
+        with self._condition:
+            while self._active >= max(1, int(self.limit)):
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, success=True, throttled=False):
+        if not self.max_limit:
+            return
+        with self._condition:
+            self._active -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            elif success:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(1.0, self.limit))
+            self._condition.notify_all()
+
+
+class ModelLimiter:
+    """Лимиты одной модели: запросы в минуту, токены в минуту и параллельность"""
+
+    def __init__(self, rpm=0, tpm=0, max_concurrency=0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+
+    @classmethod
+    def from_env(cls, prefix):
+        """Например prefix='IMAGE_MODEL' читает IMAGE_MODEL_RPM, IMAGE_MODEL_TPM, IMAGE_MODEL_MAX_CONCURRENCY"""
+        return cls(
+            rpm=int(os.getenv(f'{prefix}_RPM', 0)),
+            tpm=int(os.getenv(f'{prefix}_TPM', 0)),
+            max_concurrency=int(os.getenv(f'{prefix}_MAX_CONCURRENCY', 0)),
+        )
+
+
+def estimate_tokens(contents):
+    """Грубая оценка входных токенов до запроса (~4 символа на токен)"""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    total = 0
+    for item in contents:
+        if isinstance(item, str):
+            total += len(item) // 4 + 1
+        else:
+            total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+def retry_after_seconds(error):
+    """Подсказка сервера о паузе: заголовок Retry-After или RetryInfo в теле ошибки"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers:
+        value = headers.get('retry-after')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    details = getattr(error, 'details', None)
+    try:
+        for detail in details['error']['details']:
+            if detail.get('@type', '').endswith('RetryInfo'):
+                return float(str(detail['retryDelay']).rstrip('s'))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def is_retryable(error):
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # Сетевые ошибки google-genai - исключения httpx (разрыв соединения, таймауты).
+    # httpx не импортируется здесь заранее: если ошибка от него, модуль уже загружен
+    httpx = sys.modules.get('httpx')
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+class GeminiCallLayer:
+    """
+    Общая точка вызова generate_content: лимиты по модели,
+    повторы с экспоненциальной задержкой и статистика.
+    client_factory - создание клиента при первом запросе, если client не передан.
+    """
+
+    def __init__(self, client, limiters=None, max_retries=None, backoff_base=None, backoff_max=None, metrics=None,
+                 client_factory=None):
+        self._client = client
+        self._client_factory = client_factory
+        self.limiters = limiters or {}
+        self.metrics = metrics
+        self.max_retries = int(os.getenv('GEMINI_MAX_RETRIES', 5)) if max_retries is None else max_retries
+        self.backoff_base = float(os.getenv('GEMINI_BACKOFF_BASE', 1.0)) if backoff_base is None else backoff_base
+        self.backoff_max = float(os.getenv('GEMINI_BACKOFF_MAX', 60.0)) if backoff_max is None else backoff_max
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self.errors_by_code = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def _limiter(self, model):
+        limiter = self.limiters.get(model)
+        if limiter is None:
+            with self._lock:
+                limiter = self.limiters.setdefault(model, ModelLimiter())
+        return limiter
+
+    def _backoff_delay(self, error, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        # Джиттер, чтобы параллельные потоки не повторяли запросы синхронно
+        delay = random.uniform(delay / 2, delay)
+        hint = retry_after_seconds(error)
+        if hint is not None:
+            delay = max(delay, hint)
+        return delay
+
+    def generate_content(self, model, contents, config=None):
+        limiter = self._limiter(model)
+        estimated_tokens = estimate_tokens(contents)
+        attempt = 0
+
+        while True:
+            waited = limiter.requests.acquire()
+            waited += limiter.tokens.acquire(estimated_tokens)
+            limiter.concurrency.acquire()
+            with self._lock:
+                self.calls += 1
+                self.throttled_seconds += waited
+
+            started = time.perf_counter()
+            try:
+                response = self.client.models.generate_content(model=model, contents=contents, config=config)
+            except Exception as e:
+                latency = time.perf_counter() - started
+                retryable = is_retryable(e)
+                limiter.concurrency.release(success=False, throttled=retryable)
+                code = getattr(e, 'code', None) or type(e).__name__
+                with self._lock:
+                    self.errors_by_code[code] = self.errors_by_code.get(code, 0) + 1
+
+                will_retry = retryable and attempt < self.max_retries
+                if self.metrics is not None:
+                    self.metrics.record(
+                        'api_call', latency, model=model, attempt=attempt, throttled_seconds=round(waited, 3),
+                        error=f"{type(e).__name__}: {e}", outcome='retry' if will_retry else 'failed',
+                        retries=1 if will_retry else 0,
+                    )
+
+                if not will_retry:
+                    with self._lock:
+                        self.failures += 1
+                    raise
+
+                delay = self._backoff_delay(e, attempt)
+                with self._lock:
+                    self.retries += 1
+                    self.backoff_seconds += delay
+                print(f"🔁 {model}: ошибка {code}, повтор {attempt + 1}/{self.max_retries} через {delay:.1f} с")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            latency = time.perf_counter() - started
+            limiter.concurrency.release(success=True)
+
+            # Уточняем расход токенов по фактическим данным ответа
+            usage = getattr(response, 'usage_metadata', None)
+            actual_tokens = getattr(usage, 'total_token_count', None)
+            if isinstance(actual_tokens, int):
+                limiter.tokens.adjust(actual_tokens - estimated_tokens)
+
+            if self.metrics is not None:
+                self.metrics.record(
+                    'api_call', latency, model=model, attempt=attempt, throttled_seconds=round(waited, 3),
+                    outcome='ok',
+                    prompt_tokens=getattr(usage, 'prompt_token_count', None),
+                    response_tokens=getattr(usage, 'candidates_token_count', None),
+                    total_tokens=actual_tokens,
+                )
+
+            return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "errors_by_code": dict(self.errors_by_code),
+                "concurrency_limits": {
+                    model: limiter.concurrency.limit for model, limiter in self.limiters.items()
+                },
+            }
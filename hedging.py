@@ -0,0 +1,116 @@
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class RequestHedger:
+    """
+    Дублирующие (hedged) запросы для сокращения хвостовых задержек.
+    Если за delay секунд результата нет или первый успешный ответ пустой,
+    отправляется второй такой же запрос и берется первый валидный результат.
+    Число дублей ограничено бюджетом на пакет.
+    """
+
+    def __init__(self, delay=None, budget=None, max_workers=None):
+        self.delay = float(os.getenv('IMAGE_HEDGE_DELAY', 20)) if delay is None else delay
+        self.budget = int(os.getenv('IMAGE_HEDGE_BUDGET', 10)) if budget is None else budget
+        self._remaining = self.budget
+        # Основной запрос и дубль на каждый параллельный запрос изображения
+        self.max_workers = max_workers or max(16, 2 * int(os.getenv('IMAGE_CONCURRENCY', 2)))
+        # Проигравший запрос нельзя прервать - он дорабатывает в фоне, результат игнорируется
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def ensure_capacity(self, concurrency):
+        """Пул на concurrency параллельных запросов: по основному и дублю на каждый"""
+        with self._lock:
+            if 2 * concurrency <= self.max_workers:
+                return
+            self.max_workers = 2 * concurrency
+            old_executor = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+        # Запросы в старом пуле дорабатывают, новые идут в новый
+        old_executor.shutdown(wait=False)
+
+    def reset_budget(self, budget=None):
+        """Новый бюджет дублей, например в начале пакета"""
+        with self._lock:
+            if budget is not None:
+                self.budget = budget
+            self._remaining = self.budget
+
+    def _take_budget(self):
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            self.hedges_fired += 1
+            return True
+
+    def call(self, request, extract):
+        """
+        request() - выполняет запрос и возвращает ответ
+        extract(response) - достает результат или None, если ответ не подходит
+        """
+        with self._lock:
+            self.requests += 1
+
+        # Отсчет delay начинается с фактического старта запроса, а не с постановки в пул:
+        # запрос, ждущий свободного потока, не должен считаться медленным
+        started = threading.Event()
+
+        def run_primary():
+            started.set()
+            return request()
+
+        primary = self._executor.submit(run_primary)
+        started.wait()
+        done, _ = wait([primary], timeout=self.delay)
+
+        if done:
+            # Ошибка основного запроса уже прошла повторы слоя вызовов - дубль ее не исправит
+            result = extract(primary.result())
+            if result is not None or not self._take_budget():
+                return result
+            print("🔀 Ответ без изображения - отправляю дублирующий запрос")
+            return self._await_first_valid([self._executor.submit(request)], extract, hedge_index=0)
+
+        if not self._take_budget():
+            return extract(primary.result())
+
+        print(f"🔀 Нет ответа за {self.delay:.1f} с - отправляю дублирующий запрос")
+        hedge = self._executor.submit(request)
+        return self._await_first_valid([primary, hedge], extract, hedge_index=1)
+
+    def _await_first_valid(self, futures, extract, hedge_index):
+        pending = set(futures)
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = extract(future.result())
+                except Exception as e:
+                    last_error = e
+                    continue
+                if result is not None:
+                    if future is futures[hedge_index]:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return result
+        if last_error is not None:
+            raise last_error
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "budget_remaining": self._remaining,
+            }
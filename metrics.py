@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Границы гистограммы задержек в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Числовые поля событий, которые суммируются в счетчики
+COUNTER_FIELDS = ('bytes_in', 'bytes_out', 'prompt_tokens', 'response_tokens', 'total_tokens', 'retries')
+
+
+class JsonlExporter:
+    """Хук: каждое событие - одна строка JSON в файле"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class PipelineMetrics:
+    """
+    Метрики этапов генерации: время, токены, байты, исходы кэшей и повторов.
+    События передаются в хуки (любые callable), агрегаты выгружаются в формате Prometheus.
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._outcomes = {}
+        self._errors = {}
+
+    @classmethod
+    def from_env(cls):
+        metrics = cls()
+        jsonl_path = os.getenv('METRICS_JSONL_PATH')
+        if jsonl_path:
+            metrics.add_hook(JsonlExporter(jsonl_path))
+        return metrics
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """
+        Замер этапа. Внутри блока в словарь события можно дописать поля:
+            with metrics.stage('image_request') as event:
+                event['bytes_out'] = len(data)
+        """
+        event = dict(fields)
+        started = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event.setdefault('error', f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, **event)
+
+    def record(self, name, seconds, **fields):
+        """Запись готового события (например, задержка API, измеренная снаружи)"""
+        event = {'ts': round(time.time(), 3), 'stage': name, 'seconds': round(seconds, 6), **fields}
+        event.setdefault('ok', 'error' not in event)
+        labels = (name, fields.get('model', ''))
+
+        with self._lock:
+            histogram = self._histograms.setdefault(labels, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+            for field in COUNTER_FIELDS:
+                value = fields.get(field)
+                if isinstance(value, (int, float)):
+                    key = labels + (field,)
+                    self._counters[key] = self._counters.get(key, 0) + value
+
+            if 'outcome' in fields:
+                key = labels + (str(fields['outcome']),)
+                self._outcomes[key] = self._outcomes.get(key, 0) + 1
+            if not event['ok']:
+                self._errors[labels] = self._errors.get(labels, 0) + 1
+
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                print(f"⚠️ Ошибка хука метрик: {e}")
+
+    def summary(self):
+        """Краткая сводка по этапам: число, среднее и p50/p95/p99 по бакетам гистограммы"""
+        with self._lock:
+            histograms = {labels: dict(h, buckets=list(h['buckets'])) for labels, h in self._histograms.items()}
+
+        summary = {}
+        for (stage, model), histogram in sorted(histograms.items()):
+            count = histogram['count']
+            name = f"{stage}[{model}]" if model else stage
+            summary[name] = {
+                'count': count,
+                'mean': histogram['sum'] / count if count else 0.0,
+                'p50': _bucket_quantile(histogram, 0.50),
+                'p95': _bucket_quantile(histogram, 0.95),
+                'p99': _bucket_quantile(histogram, 0.99),
+            }
+        return summary
+
+    def write_prometheus(self, path=None):
+        """Выгрузка агрегатов в текстовом формате Prometheus (для node_exporter textfile)"""
+        path = path or os.getenv('METRICS_PROMETHEUS_PATH')
+        if not path:
+            return None
+
+        lines = [
+            '# HELP poster_stage_seconds Время этапа генерации постера',
+            '# TYPE poster_stage_seconds histogram',
+        ]
+        with self._lock:
+            for (stage, model), histogram in sorted(self._histograms.items()):
+                labels = _format_labels(stage=stage, model=model)
+                for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    lines.append(f'poster_stage_seconds_bucket{_format_labels(stage=stage, model=model, le=bound)} {count}')
+                lines.append(f'poster_stage_seconds_bucket{_format_labels(stage=stage, model=model, le="+Inf")} {histogram["count"]}')
+                lines.append(f'poster_stage_seconds_sum{labels} {histogram["sum"]:.6f}')
+                lines.append(f'poster_stage_seconds_count{labels} {histogram["count"]}')
+
+            lines += ['# HELP poster_stage_total Суммы числовых полей (байты, токены, повторы)',
+                      '# TYPE poster_stage_total counter']
+            for (stage, model, field), value in sorted(self._counters.items()):
+                lines.append(f'poster_stage_total{_format_labels(stage=stage, model=model, field=field)} {value}')
+
+            lines += ['# HELP poster_stage_outcomes_total Исходы этапов (попадание в кэш, источник данных и т.д.)',
+                      '# TYPE poster_stage_outcomes_total counter']
+            for (stage, model, outcome), value in sorted(self._outcomes.items()):
+                lines.append(f'poster_stage_outcomes_total{_format_labels(stage=stage, model=model, outcome=outcome)} {value}')
+
+            lines += ['# HELP poster_stage_errors_total Ошибки этапов',
+                      '# TYPE poster_stage_errors_total counter']
+            for (stage, model), value in sorted(self._errors.items()):
+                lines.append(f'poster_stage_errors_total{_format_labels(stage=stage, model=model)} {value}')
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        os.replace(tmp_path, path)
+        return path
+
+
+def _format_labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        if value == '' or value is None:
+            continue
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _bucket_quantile(histogram, quantile):
+    """Оценка квантиля по верхней границе бакета"""
+    count = histogram['count']
+    if not count:
+        return 0.0
+    target = quantile * count
+    for bound, bucket_count in zip(LATENCY_BUCKETS, histogram['buckets']):
+        if bucket_count >= target:
+            return float(bound)
+    return float('inf')
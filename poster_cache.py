@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+# Расширения файлов для MIME типов изображений из ответа API
+MIME_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+}
+
+
+class PosterCache:
+    """
+    Кэш готовых постеров с адресацией по содержимому.
+    Ключ - SHA-256 от итогового промпта, байтов референса, модели и настроек генерации,
+    поэтому одинаковый запрос не отправляется в API повторно.
+    """
+
+    def __init__(self, directory):
+        # Каталоги создаются при первой записи: процессы только с характеристиками их не трогают
+        self.directory = Path(directory)
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt, reference_bytes, model, config):
+        """Хэш всех входных данных, влияющих на результат генерации"""
+        digest = hashlib.sha256()
+        for chunk in (
+            prompt.encode('utf-8'),
+            reference_bytes,
+            model.encode('utf-8'),
+            json.dumps(config, sort_keys=True).encode('utf-8'),
+        ):
+            # Длина перед каждым блоком, чтобы границы блоков не смешивались
+            digest.update(len(chunk).to_bytes(8, 'big'))
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return self.directory / key[:2]
+
+    def get(self, key):
+        """Путь к сохраненному постеру или None"""
+        entry_dir = self._entry_dir(key)
+        matches = sorted(entry_dir.glob(f"{key}.*")) if entry_dir.exists() else []
+        with self._lock:
+            if matches:
+                self.hits += 1
+                return matches[0]
+            self.misses += 1
+        return None
+
+    def put(self, key, data, mime_type):
+        """Сохраняет исходные байты изображения из ответа API"""
+        extension = MIME_EXTENSIONS.get(mime_type, 'png')
+        entry_dir = self._entry_dir(key)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+
+        path = entry_dir / f"{key}.{extension}"
+        # Атомарная запись: параллельные процессы не увидят недописанный файл
+        tmp_path = entry_dir / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.stores += 1
+        return path
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,189 @@
+import os
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Шаблон верстки по референсу. Координаты и размеры - доли ширины/высоты постера,
+# поэтому один шаблон подходит для любого размера с соотношением примерно 3:4.
+DEFAULT_LAYOUT = {
+    "size": (1200, 1600),
+    "background": "#F5F5F5",
+    "make": {"x": 0.07, "y": 0.05, "size": 0.055, "color": "#333333", "bold": True},
+    "model": {"x": 0.07, "y": 0.095, "size": 0.095, "color": "#000000", "bold": True},
+    "car_box": (0.03, 0.22, 0.97, 0.68),
+    "grid_top": 0.72,
+    # Левый край и ширина колонок сетки характеристик
+    "columns": ((0.07, 0.20), (0.31, 0.29), (0.64, 0.29)),
+    "row_height": 0.055,
+    "label_size": 0.018,
+    "value_size": 0.026,
+    "label_color": "#666666",
+    "value_color": "#000000",
+    "flag": {"x": 0.85, "y": 0.92, "width": 0.09},
+}
+
+# Подписи характеристик на разных языках
+LABELS = {
+    "en": {
+        "year": "YEAR", "engine": "Engine", "power": "Power", "torque": "Torque",
+        "weight": "Weight", "acceleration": "0-100 km/h", "top_speed": "Top speed",
+    },
+    "ru": {
+        "year": "ГОД", "engine": "Двигатель", "power": "Мощность", "torque": "Момент",
+        "weight": "Масса", "acceleration": "0-100 км/ч", "top_speed": "Макс. скорость",
+    },
+}
+
+# Упрощенные флаги: полосы (горизонтальные или вертикальные) для большинства стран
+STRIPED_FLAGS = {
+    "DE": ("h", ["#000000", "#DD0000", "#FFCE00"]),
+    "IT": ("v", ["#009246", "#FFFFFF", "#CE2B37"]),
+    "FR": ("v", ["#0055A4", "#FFFFFF", "#EF4135"]),
+    "AT": ("h", ["#ED2939", "#FFFFFF", "#ED2939"]),
+    "NL": ("h", ["#AE1C28", "#FFFFFF", "#21468B"]),
+    "RU": ("h", ["#FFFFFF", "#0039A6", "#D52B1E"]),
+    "ES": ("h", ["#AA151B", "#F1BF00", "#F1BF00", "#AA151B"]),
+    "BE": ("v", ["#000000", "#FDDA24", "#EF3340"]),
+    "RO": ("v", ["#002B7F", "#FCD116", "#CE1126"]),
+}
+
+FONT_CANDIDATES = ("Helvetica.ttc", "Arial.ttf", "DejaVuSans.ttf")
+BOLD_FONT_CANDIDATES = ("Helvetica.ttc", "Arial Bold.ttf", "arialbd.ttf", "DejaVuSans-Bold.ttf")
+
+
+@lru_cache(maxsize=64)
+def load_font(size, bold=False):
+    """Шрифт из POSTER_FONT/POSTER_FONT_BOLD или первый найденный системный sans-serif"""
+    configured = os.getenv('POSTER_FONT_BOLD' if bold else 'POSTER_FONT')
+    candidates = ((configured,) if configured else ()) + (BOLD_FONT_CANDIDATES if bold else FONT_CANDIDATES)
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+
+def fit_font(draw, text, size, max_width, bold=False):
+    """Самый крупный шрифт не больше size, при котором text помещается в max_width"""
+    font = load_font(size, bold)
+    while size > 8 and draw.textlength(text, font=font) > max_width:
+        size = int(size * 0.9)
+        font = load_font(size, bold)
+    return font
+
+
+def draw_flag(draw, country_code, box):
+    """Рисует упрощенный флаг страны в прямоугольнике box = (x0, y0, x1, y1)"""
+    x0, y0, x1, y1 = box
+    width, height = x1 - x0, y1 - y0
+    code = (country_code or '').upper()
+
+    if code in STRIPED_FLAGS:
+        direction, colors = STRIPED_FLAGS[code]
+        for i, color in enumerate(colors):
+            if direction == 'h':
+                draw.rectangle((x0, y0 + height * i / len(colors), x1, y0 + height * (i + 1) / len(colors)), fill=color)
+            else:
+                draw.rectangle((x0 + width * i / len(colors), y0, x0 + width * (i + 1) / len(colors), y1), fill=color)
+    elif code == 'JP':
+        draw.rectangle(box, fill="#FFFFFF")
+        radius = height * 0.3
+        cx, cy = x0 + width / 2, y0 + height / 2
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill="#BC002D")
+    elif code == 'KR':
+        draw.rectangle(box, fill="#FFFFFF")
+        radius = height * 0.25
+        cx, cy = x0 + width / 2, y0 + height / 2
+        draw.pieslice((cx - radius, cy - radius, cx + radius, cy + radius), 180, 360, fill="#CD2E3A")
+        draw.pieslice((cx - radius, cy - radius, cx + radius, cy + radius), 0, 180, fill="#0047A0")
+    elif code in ('SE', 'NO', 'DK', 'FI'):
+        background, cross = {
+            'SE': ("#006AA7", "#FECC00"), 'NO': ("#BA0C2F", "#FFFFFF"),
+            'DK': ("#C8102E", "#FFFFFF"), 'FI': ("#FFFFFF", "#002F6C"),
+        }[code]
+        draw.rectangle(box, fill=background)
+        bar = height * 0.2
+        draw.rectangle((x0, y0 + (height - bar) / 2, x1, y0 + (height + bar) / 2), fill=cross)
+        draw.rectangle((x0 + width * 0.3, y0, x0 + width * 0.3 + bar, y1), fill=cross)
+    elif code == 'CZ':
+        draw.rectangle((x0, y0, x1, y0 + height / 2), fill="#FFFFFF")
+        draw.rectangle((x0, y0 + height / 2, x1, y1), fill="#D7141A")
+        draw.polygon([(x0, y0), (x0 + width / 2, y0 + height / 2), (x0, y1)], fill="#11457E")
+    elif code == 'US':
+        stripe = height / 13
+        for i in range(13):
+            draw.rectangle((x0, y0 + stripe * i, x1, y0 + stripe * (i + 1)), fill="#B22234" if i % 2 == 0 else "#FFFFFF")
+        draw.rectangle((x0, y0, x0 + width * 0.4, y0 + stripe * 7), fill="#3C3B6E")
+    elif code == 'GB':
+        draw.rectangle(box, fill="#012169")
+        draw.line((x0, y0, x1, y1), fill="#FFFFFF", width=max(1, int(height * 0.2)))
+        draw.line((x0, y1, x1, y0), fill="#FFFFFF", width=max(1, int(height * 0.2)))
+        draw.line((x0, y0, x1, y1), fill="#C8102E", width=max(1, int(height * 0.07)))
+        draw.line((x0, y1, x1, y0), fill="#C8102E", width=max(1, int(height * 0.07)))
+        draw.rectangle((x0, y0 + height * 0.33, x1, y0 + height * 0.67), fill="#FFFFFF")
+        draw.rectangle((x0 + width * 0.42, y0, x0 + width * 0.58, y1), fill="#FFFFFF")
+        draw.rectangle((x0, y0 + height * 0.4, x1, y0 + height * 0.6), fill="#C8102E")
+        draw.rectangle((x0 + width * 0.45, y0, x0 + width * 0.55, y1), fill="#C8102E")
+    else:
+        # Неизвестная страна - код в рамке
+        draw.rectangle(box, fill="#FFFFFF", outline="#333333", width=max(1, int(height * 0.04)))
+        font = load_font(max(8, int(height * 0.5)), bold=True)
+        draw.text((x0 + width / 2, y0 + height / 2), code or '?', fill="#333333", font=font, anchor='mm')
+        return
+
+    draw.rectangle(box, outline="#DDDDDD", width=1)
+
+
+def compose_poster(car_image, specs, language='en', size=None, layout=None):
+    """
+    Верстка постера локально: заголовки, фото автомобиля, сетка характеристик и флаг.
+    car_image - рендер автомобиля на чистом светлом фоне (PIL Image).
+    """
+    layout = layout or DEFAULT_LAYOUT
+    labels = LABELS.get(language, LABELS['en'])
+    width, height = size or layout['size']
+
+    poster = Image.new('RGB', (width, height), layout['background'])
+    draw = ImageDraw.Draw(poster)
+
+    # Заголовки: марка и модель
+    for field in ('make', 'model'):
+        style = layout[field]
+        text = str(specs[field]).upper()
+        font = fit_font(draw, text, int(height * style['size'] * 0.75), width * (1 - 2 * style['x']), style['bold'])
+        draw.text((width * style['x'], height * style['y']), text, fill=style['color'], font=font)
+
+    # Автомобиль вписывается в свою область с сохранением пропорций
+    bx0, by0, bx1, by1 = layout['car_box']
+    box_width, box_height = int(width * (bx1 - bx0)), int(height * (by1 - by0))
+    car = car_image.convert('RGB')
+    scale = min(box_width / car.width, box_height / car.height)
+    car = car.resize((max(1, int(car.width * scale)), max(1, int(car.height * scale))), Image.LANCZOS)
+    poster.paste(car, (int(width * bx0 + (box_width - car.width) / 2), int(height * by0 + (box_height - car.height) / 2)))
+
+    # Сетка характеристик: год слева, 4 строки в центре, 2 строки справа
+    label_font = load_font(int(height * layout['label_size']))
+    value_size = int(height * layout['value_size'])
+    row_height = height * layout['row_height']
+    top = height * layout['grid_top']
+    columns = [
+        [('year', specs['year_range'])],
+        [(field, specs[field]) for field in ('engine', 'power', 'torque', 'weight')],
+        [(field, specs[field]) for field in ('acceleration', 'top_speed')],
+    ]
+    # Подпись над значением; длинные значения уменьшаются до ширины колонки
+    for (column_x, column_width), rows in zip(layout['columns'], columns):
+        for row, (field, value) in enumerate(rows):
+            x = width * column_x
+            y = top + row * row_height
+            value_font = fit_font(draw, str(value), value_size, width * column_width, bold=True)
+            draw.text((x, y), labels[field], fill=layout['label_color'], font=label_font)
+            draw.text((x, y + label_font.size * 1.3), str(value), fill=layout['value_color'], font=value_font)
+
+    flag = layout['flag']
+    flag_width = width * flag['width']
+    flag_x, flag_y = width * flag['x'], height * flag['y']
+    draw_flag(draw, specs.get('country_code'), (flag_x, flag_y, flag_x + flag_width, flag_y + flag_width * 2 / 3))
+
+    return poster
@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from car_poster_generator import CarPosterGenerator, load_env
+from spec_cache import SpecCache
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+}
+
+
+class PosterJobQueue:
+    """
+    Очередь заданий поверх одного "теплого" генератора.
+    Одинаковые задания (марка/модель/год/комплектация/цвет), пока они в работе,
+    объединяются: API вызывается один раз, результат получают все ожидающие.
+    """
+
+    def __init__(self, generator, workers=None, history_limit=None, hedge_budget_window=None):
+        self.generator = generator
+        self.workers = workers or int(os.getenv('SERVER_WORKERS', 4))
+        self.history_limit = history_limit or int(os.getenv('SERVER_JOB_HISTORY', 1000))
+        # Бюджет дублирующих запросов обновляется раз в окно, а не один раз на жизнь процесса
+        self.hedge_budget_window = (float(os.getenv('SERVER_HEDGE_BUDGET_WINDOW', 3600))
+                                    if hedge_budget_window is None else hedge_budget_window)
+        self._hedge_budget_reset_at = time.monotonic()
+        self.jobs_directory = Path(generator.output_directory) / 'jobs'
+        self.jobs_directory.mkdir(parents=True, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='poster-job')
+        if generator.hedger is not None:
+            generator.hedger.ensure_capacity(self.workers)
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def job_key(request):
+        key = SpecCache.make_key(request['make'], request['model'], request.get('year'), request.get('trim'))
+        color = ' '.join(str(request.get('color') or '').lower().split())
+        return f"{key}|{color}"
+
+    def submit(self, request):
+        """Постановка задания; возвращает (задание, объединено_ли_с_существующим)"""
+        key = self.job_key(request)
+        with self._lock:
+            self.submitted += 1
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                self.coalesced += 1
+                job = self._jobs[job_id]
+                job['waiters'] += 1
+                return job, True
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'request': request,
+                'status': 'queued',
+                'output': None,
+                'derivatives': None,
+                'error': None,
+                'waiters': 1,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'done': threading.Event(),
+            }
+            self._jobs[job['id']] = job
+            self._in_flight[key] = job['id']
+            self._trim_history()
+
+        self._executor.submit(self._run, job)
+        return job, False
+
+    def _trim_history(self):
+        # Старые завершенные задания удаляются вместе с файлами, чтобы не росли ни память, ни диск;
+        # незавершенные пропускаются и не мешают удалять более новые
+        excess = len(self._jobs) - self.history_limit
+        if excess <= 0:
+            return
+        for job_id, job in list(self._jobs.items()):
+            if excess <= 0:
+                break
+            if job['done'].is_set():
+                del self._jobs[job_id]
+                self._remove_job_files(job)
+                excess -= 1
+
+    def _remove_job_files(self, job):
+        paths = [job['output']] if job['output'] else []
+        if isinstance(job['derivatives'], list):
+            paths += [derivative['path'] for derivative in job['derivatives']]
+        for path in paths:
+            path = Path(path)
+            # Удаляем только файлы очереди, а не чужие пути
+            if path.parent.resolve() == self.jobs_directory.resolve():
+                path.unlink(missing_ok=True)
+
+    def _maybe_reset_hedge_budget(self):
+        hedger = self.generator.hedger
+        if hedger is None or self.hedge_budget_window <= 0:
+            return
+        with self._lock:
+            if time.monotonic() - self._hedge_budget_reset_at < self.hedge_budget_window:
+                return
+            self._hedge_budget_reset_at = time.monotonic()
+        hedger.reset_budget()
+
+    def _run(self, job):
+        request = job['request']
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        output_path = self.jobs_directory / f"{job['id']}.{self.generator.output_format}"
+        self._maybe_reset_hedge_budget()
+        try:
+            job['output'] = self.generator.generate_poster(
+                make=request['make'],
+                model=request['model'],
+                year=request.get('year'),
+                trim=request.get('trim'),
+                color=request.get('color'),
+                output_path=output_path,
+            )
+            # Производные версии забираются сразу, иначе задачи копятся в очереди пайплайна
+            if self.generator.derivative_pipeline is not None:
+                job['derivatives'] = self.generator.collect_derivatives([job['output']]).get(str(job['output']))
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = f"{type(e).__name__}: {e}"
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+            with self._lock:
+                if self._in_flight.get(job['key']) == job['id']:
+                    del self._in_flight[job['key']]
+            job['done'].set()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def describe(self, job):
+        return {
+            'job_id': job['id'],
+            'status': job['status'],
+            'request': job['request'],
+            'waiters': job['waiters'],
+            'error': job['error'],
+            'derivatives': job['derivatives'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'result_url': f"/jobs/{job['id']}/result" if job['status'] == 'done' else None,
+        }
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job['status']] = statuses.get(job['status'], 0) + 1
+            stats = {
+                'workers': self.workers,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'jobs': statuses,
+            }
+        stats['api'] = self.generator.gemini.stats()
+        if self.generator.spec_cache is not None:
+            stats['spec_cache'] = self.generator.spec_cache.stats()
+        if self.generator.poster_cache is not None:
+            stats['poster_cache'] = self.generator.poster_cache.stats()
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class PosterRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs                 - новое задание: {"make", "model", "year", "trim", "color"}
+    GET  /jobs/<id>            - статус задания
+    GET  /jobs/<id>/result     - готовый постер (?wait=секунды - подождать завершения)
+    GET  /stats, GET /health
+    """
+
+    queue = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/jobs':
+            return self._send_json(404, {'error': 'not found'})
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                return self._send_json(400, {'error': 'некорректный Content-Length'})
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError):
+            return self._send_json(400, {'error': 'тело запроса должно быть JSON'})
+
+        if not isinstance(request, dict) or not request.get('make') or not request.get('model'):
+            return self._send_json(400, {'error': 'марка (make) и модель (model) обязательны'})
+        if request.get('year') is not None:
+            try:
+                request['year'] = int(request['year'])
+            except (TypeError, ValueError):
+                return self._send_json(400, {'error': 'year должен быть числом'})
+
+        request = {field: request.get(field) for field in ('make', 'model', 'year', 'trim', 'color')}
+        job, coalesced = self.queue.submit(request)
+        self._send_json(202, {**self.queue.describe(job), 'coalesced': coalesced})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['health']:
+            return self._send_json(200, {'status': 'ok'})
+        if parts == ['stats']:
+            return self._send_json(200, self.queue.stats())
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or (len(parts) == 3 and parts[2] != 'result'):
+            return self._send_json(404, {'error': 'not found'})
+
+        job = self.queue.get(parts[1])
+        if job is None:
+            return self._send_json(404, {'error': 'задание не найдено'})
+
+        if len(parts) == 2:
+            return self._send_json(200, self.queue.describe(job))
+
+        wait = parse_qs(url.query).get('wait')
+        if wait:
+            try:
+                timeout = min(float(wait[0]), 300)
+            except ValueError:
+                return self._send_json(400, {'error': 'wait должен быть числом секунд'})
+            job['done'].wait(timeout=timeout)
+
+        if job['status'] == 'failed':
+            return self._send_json(500, self.queue.describe(job))
+        if job['status'] != 'done':
+            return self._send_json(409, self.queue.describe(job))
+
+        path = Path(job['output'])
+        try:
+            body = path.read_bytes()
+        except FileNotFoundError:
+            # Файл удален очисткой истории между поиском задания и чтением
+            return self._send_json(410, {'error': 'результат задания удален'})
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(path.suffix.lstrip('.'), 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    load_env()
+    parser = argparse.ArgumentParser(description="HTTP сервер генерации постеров с очередью заданий")
+    parser.add_argument('--host', default=os.getenv('SERVER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVER_PORT', 8080)))
+    parser.add_argument('--workers', type=int, default=None, help="Параллельных заданий (SERVER_WORKERS)")
+    args = parser.parse_args(argv)
+
+    # Генератор создается один раз: клиент, пул соединений и референс остаются "теплыми"
+    generator = CarPosterGenerator()
+    # Клиент и референс ленивые: готовятся до приема запросов, а не в первом задании
+    print("🔥 Прогрев: клиент Gemini и референс...")
+    generator.client
+    generator.reference_part
+    queue = PosterJobQueue(generator, workers=args.workers)
+    PosterRequestHandler.queue = queue
+
+    server = ThreadingHTTPServer((args.host, args.port), PosterRequestHandler)
+    print(f"🚀 Сервер постеров: http://{args.host}:{args.port} (заданий параллельно: {queue.workers})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Остановка сервера...")
+    finally:
+        server.server_close()
+        queue.shutdown()
+
+
+if __name__ == "__main__":
+    main()
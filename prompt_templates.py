@@ -0,0 +1,99 @@
+import argparse
+import os
+import string
+from functools import lru_cache
+from pathlib import Path
+
+from gemini_calls import estimate_tokens
+
+# Шаблоны лежат в файлах вида prompts/<имя>.<вариант>.txt, поля подставляются как {make}
+PROMPTS_DIRECTORY = Path(__file__).resolve().parent / 'prompts'
+
+# Пример значений для сравнения вариантов из командной строки
+SAMPLE_VALUES = {
+    "make": "BMW", "model": "M4 Competition", "make_upper": "BMW", "model_upper": "M4 COMPETITION",
+    "year": "2021-2024", "engine": "3.0L Twin-Turbo I6", "power": "503 HP", "torque": "650 Nm",
+    "weight": "1725 kg", "acceleration": "3.9 s", "top_speed": "250 km/h",
+    "country_code": "DE", "flag_emoji": "🇩🇪", "color_description": "в Alpine White цвете",
+}
+
+
+class PromptTemplate:
+    """Шаблон промпта, разобранный один раз на литералы и поля для быстрой подстановки"""
+
+    def __init__(self, name, variant, text):
+        self.name = name
+        self.variant = variant
+        self.text = text
+        self._parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(text)]
+        self.fields = frozenset(field for _, field in self._parts if field)
+
+    def render(self, **values):
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Шаблон {self.name}.{self.variant}: не заданы поля {', '.join(sorted(missing))}")
+        return ''.join(literal + (str(values[field]) if field else '') for literal, field in self._parts)
+
+
+def template_directory(directory=None):
+    return Path(directory or os.getenv('PROMPT_DIRECTORY') or PROMPTS_DIRECTORY)
+
+
+@lru_cache(maxsize=None)
+def _read_template(path, name, variant):
+    return PromptTemplate(name, variant, Path(path).read_text(encoding='utf-8'))
+
+
+def load_template(name, variant=None, directory=None):
+    """Шаблон загружается с диска один раз за процесс; вариант по умолчанию - PROMPT_VARIANT"""
+    variant = variant or os.getenv('PROMPT_VARIANT', 'verbose')
+    path = template_directory(directory) / f"{name}.{variant}.txt"
+    if not path.exists():
+        raise FileNotFoundError(f"Шаблон промпта не найден: {path}")
+    return _read_template(str(path), name, variant)
+
+
+def available_variants(name, directory=None):
+    return sorted(path.name[len(name) + 1:-len('.txt')] for path in template_directory(directory).glob(f"{name}.*.txt"))
+
+
+def count_tokens(text, client=None, model=None):
+    """
+    Токены промпта: точное число через count_tokens API, если передан клиент,
+    иначе локальная оценка. Возвращает (токены, источник).
+    """
+    if client is not None and model:
+        try:
+            total = client.models.count_tokens(model=model, contents=text).total_tokens
+            if total is not None:
+                return total, 'api'
+        except Exception as e:
+            print(f"⚠️ count_tokens недоступен ({type(e).__name__}), используется оценка")
+    return estimate_tokens(text), 'estimate'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Размер вариантов шаблона промпта в символах и токенах")
+    parser.add_argument('--name', default='poster', help="Имя шаблона (prompts/<имя>.<вариант>.txt)")
+    parser.add_argument('--api', action='store_true', help="Точный подсчет через count_tokens (нужен GEMINI_API_KEY)")
+    parser.add_argument('--model', default='gemini-3-pro-image-preview')
+    args = parser.parse_args(argv)
+
+    client = None
+    if args.api:
+        from dotenv import load_dotenv
+        from google import genai
+        load_dotenv()
+        client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+
+    budget = int(os.getenv('PROMPT_TOKEN_BUDGET', 0))
+    print(f"{'вариант':<12} {'символов':>9} {'токенов':>8}  источник")
+    for variant in available_variants(args.name):
+        prompt = load_template(args.name, variant).render(**SAMPLE_VALUES)
+        tokens, source = count_tokens(prompt, client, args.model)
+        over = f"  ⚠️ больше бюджета {budget}" if budget and tokens > budget else ""
+        print(f"{variant:<12} {len(prompt):>9} {tokens:>8}  {source}{over}")
+
+
+if __name__ == "__main__":
+    main()
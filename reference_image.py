@@ -0,0 +1,100 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+# Форматы, в которые можно перекодировать референс
+REFERENCE_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'jpg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+}
+
+SOURCE_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+
+@dataclass(frozen=True)
+class PreparedReference:
+    """Готовые к отправке байты референса"""
+    data: bytes
+    mime_type: str
+    size: tuple
+    source_bytes: int
+
+    @property
+    def payload_bytes(self):
+        return len(self.data)
+
+
+def prepare_reference_image(path, max_edge=1536, image_format='jpeg', quality=85, cache_dir=None):
+    """
+    Уменьшение и перекодирование референса один раз на процесс.
+    Результат дополнительно кэшируется на диске по хэшу исходного файла и настроек;
+    размер записан в имени файла, поэтому попадание в кэш не импортирует Pillow.
+    max_edge=0 - отправлять исходный файл без изменений.
+    """
+    stat = os.stat(path)
+    return _prepare_cached(
+        str(path), stat.st_mtime_ns, stat.st_size,
+        int(max_edge), image_format.lower(), int(quality),
+        str(cache_dir) if cache_dir else None,
+    )
+
+
+@lru_cache(maxsize=8)
+def _prepare_cached(path, mtime_ns, file_size, max_edge, image_format, quality, cache_dir):
+    source = Path(path).read_bytes()
+
+    if not max_edge:
+        from PIL import Image
+
+        with Image.open(BytesIO(source)) as image:
+            size = image.size
+        mime_type = SOURCE_MIME_TYPES.get(Path(path).suffix.lower(), 'image/jpeg')
+        return PreparedReference(source, mime_type, size, len(source))
+
+    if image_format not in REFERENCE_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат референса: {image_format} (jpeg или webp)")
+    pil_format, mime_type, extension = REFERENCE_FORMATS[image_format]
+
+    digest = None
+    if cache_dir:
+        digest = hashlib.sha256(source)
+        digest.update(f"|{max_edge}|{image_format}|{quality}".encode('utf-8'))
+        digest = digest.hexdigest()
+        for cache_path in Path(cache_dir).glob(f"{digest}_*x*.{extension}"):
+            width, height = cache_path.stem.rsplit('_', 1)[1].split('x')
+            return PreparedReference(cache_path.read_bytes(), mime_type, (int(width), int(height)), len(source))
+
+    from PIL import Image
+
+    with Image.open(BytesIO(source)) as image:
+        original_format = image.format
+        needs_resize = max(image.size) > max_edge
+        image = image.convert('RGB')
+        if needs_resize:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, pil_format, quality=quality)
+        data = buffer.getvalue()
+        size = image.size
+
+    # Маленький исходник в том же формате не имеет смысла раздувать перекодированием
+    if not needs_resize and original_format == pil_format and len(source) <= len(data):
+        data = source
+
+    if digest is not None:
+        cache_path = Path(cache_dir) / f"{digest}_{size[0]}x{size[1]}.{extension}"
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, cache_path)
+
+    return PreparedReference(data, mime_type, size, len(source))
@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class SpecCache:
+    """
+    Постоянный кэш характеристик автомобилей в одном SQLite файле.
+    Ключ - нормализованные марка/модель/год/комплектация,
+    устаревание по TTL и вытеснение по LRU при превышении лимита записей.
+    """
+
+    def __init__(self, path, ttl_seconds=30 * 24 * 3600, max_entries=5000):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        # Счетчики для статистики
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS specs (
+                key TEXT PRIMARY KEY,
+                specs TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS specs_accessed_at ON specs (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(make, model, year=None, trim=None):
+        """Нормализованный ключ: регистр и лишние пробелы не важны"""
+        parts = [make, model, year, trim]
+        return '|'.join(' '.join(str(part).lower().split()) if part else '' for part in parts)
+
+    def get(self, make, model, year=None, trim=None):
+        """Возвращает характеристики из кэша или None"""
+        key = self.make_key(make, model, year, trim)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT specs, created_at FROM specs WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            specs_json, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                # Запись устарела - удаляем
+                self._conn.execute("DELETE FROM specs WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE specs SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(specs_json)
+
+    def put(self, make, model, year, trim, specs):
+        """Сохраняет характеристики и вытесняет самые старые записи сверх лимита"""
+        key = self.make_key(make, model, year, trim)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO specs (key, specs, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(specs, ensure_ascii=False), now, now)
+            )
+            self.stores += 1
+
+            if self.max_entries:
+                count = self._conn.execute("SELECT COUNT(*) FROM specs").fetchone()[0]
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM specs WHERE key IN "
+                        "(SELECT key FROM specs ORDER BY accessed_at ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    self.evictions += overflow
+
+            self._conn.commit()
+
+    def invalidate(self, make, model, year=None, trim=None):
+        """Удаляет одну запись из кэша"""
+        key = self.make_key(make, model, year, trim)
+        with self._lock:
+            self._conn.execute("DELETE FROM specs WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            self._conn.execute("DELETE FROM specs")
+            self._conn.commit()
+
+    def stats(self):
+        """Статистика попаданий/промахов"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM specs").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "size": size,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
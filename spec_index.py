@@ -0,0 +1,231 @@
+import argparse
+import csv
+import json
+import os
+import pickle
+import re
+import sys
+from array import array
+from pathlib import Path
+
+INDEX_VERSION = 2
+
+# Соседние модификации, которые нечеткий поиск не должен путать: (в индексе, запрос)
+SIBLING_PAIRS = (
+    (('Land Rover', 'Range Rover Sport', None), ('Land Rover', 'Range Rover', None)),
+    (('Porsche', 'Cayenne Coupe', None), ('Porsche', 'Cayenne', None)),
+    (('Volkswagen', 'Golf Alltrack', None), ('Volkswagen', 'Golf', None)),
+    (('Porsche', '911 GT3', None), ('Porsche', '911 GT2', None)),
+    (('Porsche', '911', 'Turbo S'), ('Porsche', '911', 'Turbo')),
+    (('BMW', 'M3', None), ('BMW', 'M4', None)),
+)
+
+
+def normalize(text):
+    """Нижний регистр, без пунктуации и лишних пробелов: 'Mercedes-AMG  GT-R' -> 'mercedes amg gt r'"""
+    return ' '.join(re.sub(r'[^0-9a-zа-яё]+', ' ', str(text).lower()).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def model_designators(text):
+    """
+    Токены модели, отличающие модификации: с цифрами ('911', 'gt3', 'm4')
+    и короткие суффиксы ('s', 'rs', 'gt'). У разных автомобилей они различаются одним символом.
+    """
+    return {token for token in normalize(text).split() if len(token) <= 3 or any(c.isdigit() for c in token)}
+
+
+def parse_year_range(year_range):
+    """'2020-2024' -> (2020, 2024), '2023' -> (2023, 2023), иначе None"""
+    years = [int(y) for y in re.findall(r'(?:19|20)\d{2}', str(year_range or ''))]
+    if not years:
+        return None
+    return min(years), max(years)
+
+
+def read_spec_rows(path):
+    """Строки характеристик из CSV, JSON (массив) или JSONL"""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    with open(path, encoding='utf-8', newline='') as f:
+        if suffix == '.csv':
+            return list(csv.DictReader(f))
+        if suffix == '.jsonl':
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+class SpecIndex:
+    """
+    Локальный индекс характеристик с нечетким поиском по триграммам марки+модели+комплектации.
+    Строится один раз из CSV/JSON и сохраняется на диск, повторная загрузка - один pickle.
+    """
+
+    def __init__(self, entries, keys, postings, models, sources=None):
+        self.entries = entries
+        self.keys = keys
+        self.postings = postings
+        # Модель+комплектация без марки: по ним сверяются модификации
+        self.models = models
+        self.sources = sources or {}
+
+    @classmethod
+    def build(cls, source_paths, fields):
+        rows = [row for source in source_paths for row in read_spec_rows(source)]
+        sources = {str(path): os.stat(path).st_mtime_ns for path in source_paths}
+        return cls.from_rows(rows, fields, sources)
+
+    @classmethod
+    def from_rows(cls, rows, fields, sources=None):
+        entries, keys, models = [], [], []
+        postings = {}
+        for row in rows:
+            if not all(row.get(field) for field in fields):
+                continue
+            entry = {field: str(row[field]).strip() for field in fields}
+            key = normalize(' '.join(filter(None, [row['make'], row['model'], row.get('trim')])))
+            entry_id = len(entries)
+            entries.append(entry)
+            keys.append(key)
+            models.append(normalize(' '.join(filter(None, [row['model'], row.get('trim')]))))
+            for gram in trigrams(key):
+                postings.setdefault(gram, array('I')).append(entry_id)
+        return cls(entries, keys, postings, models, sources)
+
+    @classmethod
+    def load_or_build(cls, index_path, source_paths, fields):
+        """Загрузка индекса с диска; пересборка, если исходные файлы изменились"""
+        index_path = Path(index_path)
+        sources = {str(path): os.stat(path).st_mtime_ns for path in source_paths}
+
+        if index_path.exists():
+            with open(index_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == INDEX_VERSION and data.get('sources') == sources:
+                return cls(data['entries'], data['keys'], data['postings'], data['models'], data['sources'])
+
+        index = cls.build(source_paths, fields)
+        index.save(index_path)
+        print(f"📚 Локальный индекс характеристик собран: {len(index.entries)} записей")
+        return index
+
+    def save(self, index_path):
+        index_path = Path(index_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'version': INDEX_VERSION,
+                'sources': self.sources,
+                'entries': self.entries,
+                'keys': self.keys,
+                'postings': self.postings,
+                'models': self.models,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+
+    def lookup(self, make, model, year=None, trim=None):
+        """
+        Лучшее совпадение: (характеристики, оценка 0..1) или (None, 0.0).
+        Нечеткая оценка считается только для записей с теми же цифровыми и короткими
+        токенами модели, с комплектацией из запроса и без лишних слов модели:
+        911 GT2 не подменяется 911 GT3, а Range Rover - Range Rover Sport.
+        """
+        query = normalize(' '.join(filter(None, [make, model, trim])))
+        query_grams = trigrams(query)
+        query_model = normalize(' '.join(filter(None, [model, trim])))
+        query_model_tokens = set(query_model.split())
+        query_designators = model_designators(query_model)
+        trim_tokens = set(normalize(trim).split()) if trim else set()
+
+        overlap = {}
+        for gram in query_grams:
+            for entry_id in self.postings.get(gram, ()):
+                overlap[entry_id] = overlap.get(entry_id, 0) + 1
+
+        best_id, best_score = None, 0.0
+        for entry_id, common in overlap.items():
+            key = self.keys[entry_id]
+            if key == query:
+                score = 1.0
+            else:
+                entry_model = self.models[entry_id]
+                entry_model_tokens = set(entry_model.split())
+                if (model_designators(entry_model) != query_designators
+                        or not trim_tokens <= entry_model_tokens
+                        or not entry_model_tokens <= query_model_tokens):
+                    continue
+                # Коэффициент Дайса по триграммам
+                score = 2.0 * common / (len(query_grams) + len(trigrams(key)))
+
+            if year:
+                years = parse_year_range(self.entries[entry_id]['year_range'])
+                if years and not years[0] <= int(year) <= years[1]:
+                    # Другое поколение модели
+                    score *= 0.8
+
+            if score > best_score:
+                best_id, best_score = entry_id, score
+
+        if best_id is None:
+            return None, 0.0
+        return dict(self.entries[best_id]), best_score
+
+
+def self_check(fields):
+    """
+    Проверка на соседних модификациях: запрос не должен находить соседа нечетко,
+    а точный запрос - находить свою запись. Возвращает список ошибок.
+    """
+    rows = []
+    for make, model, trim in (entry for pair in SIBLING_PAIRS for entry in pair):
+        row = {field: 'test' for field in fields}
+        row.update({'make': make, 'model': model, 'trim': trim, 'year_range': '2020-2024'})
+        rows.append(row)
+
+    errors = []
+    for (make, model, trim), query in SIBLING_PAIRS:
+        # В индексе только соседняя запись: совпадения быть не должно
+        sibling = [row for row in rows if (row['make'], row['model'], row['trim']) == (make, model, trim)]
+        index = SpecIndex.from_rows(sibling, fields)
+        specs, score = index.lookup(query[0], query[1], 2022, query[2])
+        if specs is not None:
+            errors.append(f"{' '.join(filter(None, query))} -> {' '.join(filter(None, [make, model, trim]))} ({score:.3f})")
+
+    index = SpecIndex.from_rows(rows, fields)
+    for make, model, trim in (entry for pair in SIBLING_PAIRS for entry in pair):
+        specs, score = index.lookup(make, model, 2022, trim)
+        if specs is None or specs['model'] != model or score < 1.0:
+            errors.append(f"{' '.join(filter(None, [make, model, trim]))}: нет точного совпадения")
+    return errors
+
+
+def main(argv=None):
+    from car_poster_generator import SPEC_FIELDS
+
+    parser = argparse.ArgumentParser(description="Сборка локального индекса характеристик")
+    parser.add_argument('sources', nargs='*', help="CSV/JSON/JSONL файлы с характеристиками")
+    parser.add_argument('-o', '--output', default=os.getenv('SPEC_INDEX_PATH', 'cache/spec_index.pickle'))
+    parser.add_argument('--self-check', action='store_true', help="Проверить поиск на соседних модификациях")
+    args = parser.parse_args(argv)
+
+    if args.self_check:
+        errors = self_check(SPEC_FIELDS)
+        for error in errors:
+            print(f"❌ {error}")
+        print("✅ Соседние модификации не путаются" if not errors else f"❌ Ошибок: {len(errors)}")
+        return 1 if errors else 0
+    if not args.sources:
+        parser.error("укажите файлы с характеристиками или --self-check")
+
+    index = SpecIndex.build(args.sources, SPEC_FIELDS)
+    index.save(args.output)
+    print(f"✅ Индекс сохранен: {args.output} ({len(index.entries)} записей)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import argparse
+import json
+import sys
+from contextlib import redirect_stdout
+
+from car_poster_generator import CarPosterGenerator
+
+
+def main(argv=None):
+    """
+    Только характеристики, без генерации постера: JSON в stdout, журнал в stderr.
+    Ответ из индекса или кэша не импортирует google-genai и Pillow.
+    """
+    parser = argparse.ArgumentParser(description="Поиск характеристик автомобиля без генерации постера")
+    parser.add_argument('make', help="Марка")
+    parser.add_argument('model', help="Модель")
+    parser.add_argument('year', nargs='?', type=int, help="Год")
+    parser.add_argument('--trim', help="Комплектация")
+    parser.add_argument('--cached-only', action='store_true',
+                        help="Только локальный индекс и кэш, без запросов к API (код 1 при промахе)")
+    parser.add_argument('--refresh', action='store_true', help="Запросить заново и обновить кэш")
+    args = parser.parse_args(argv)
+
+    with redirect_stdout(sys.stderr):
+        generator = CarPosterGenerator()
+        specs = generator.search_car_specifications(
+            args.make, args.model, args.year, args.trim,
+            refresh_cache=args.refresh, use_api=not args.cached_only,
+        )
+
+    if specs is None:
+        print(f"❌ Нет в индексе и кэше: {args.make} {args.model}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(specs, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from spec_cache import SpecCache
+
+# Тяжелые пакеты, которые не должны импортироваться на коротких путях
+HEAVY_MODULES = ('google.genai', 'PIL', 'dotenv')
+
+SAMPLE_SPECS = {
+    "make": "BMW", "model": "M4 Competition", "year_range": "2021-2024",
+    "engine": "3.0L Twin-Turbo I6", "power": "503 HP", "torque": "650 Nm", "weight": "1725 kg",
+    "acceleration": "3.9 s", "top_speed": "250 km/h", "country_code": "DE",
+}
+
+# Сценарии запуска: короткие процессы, как в cron
+SCENARIOS = {
+    'import': ['-c', 'import car_poster_generator'],
+    'generator_init': ['-c', 'from car_poster_generator import CarPosterGenerator; CarPosterGenerator()'],
+    'spec_cached': ['-m', 'spec_lookup', 'BMW', 'M4 Competition', '2023', '--cached-only'],
+    'image_stack': ['-c', 'import car_poster_generator, PIL.Image, google.genai.types'],
+}
+
+
+def parse_importtime(stderr):
+    """
+    Разбор вывода python -X importtime: {модуль: (накопленное время в мкс, глубина)}.
+    Глубина - отступ имени: 0 у внешних импортов, их время уже включает вложенные.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(cumulative), depth)
+    return modules
+
+
+def run_once(args, env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + args
+    started = time.perf_counter()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)}: код {completed.returncode}\n{completed.stderr[-2000:]}")
+    return elapsed, completed.stderr
+
+
+def git_revision():
+    try:
+        # Ревизия репозитория с бенчмарком, а не каталога, из которого он запущен
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время запуска коротких процессов (python -X importtime)")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=5, help="Запусков на сценарий (берется медиана)")
+    parser.add_argument('--top', type=int, default=5, help="Самых долгих импортов в отчете")
+    parser.add_argument('--reference', default='photo_2026-02-13_02-02-39.jpg')
+    parser.add_argument('--output', default='benchmarks/startup.jsonl', help="Куда дописывать результаты (JSONL)")
+    args = parser.parse_args(argv)
+
+    root = Path(__file__).resolve().parent
+    revision = git_revision()
+
+    with tempfile.TemporaryDirectory(prefix='poster_startup_') as workdir:
+        # Изолированные кэши: характеристика для spec_cached уже лежит в кэше
+        cache = SpecCache(Path(workdir) / 'specs.sqlite3')
+        cache.put('BMW', 'M4 Competition', 2023, None, SAMPLE_SPECS)
+        cache.close()
+
+        env = dict(os.environ)
+        env.update({
+            'PYTHONPATH': str(root),
+            'REFERENCE_IMAGE_PATH': str(root / args.reference),
+            'SPEC_CACHE_PATH': str(Path(workdir) / 'specs.sqlite3'),
+            'POSTER_CACHE_DIR': str(Path(workdir) / 'posters'),
+            'SPEC_INDEX_SOURCES': '',
+            'METRICS_JSONL_PATH': '',
+            'DERIVATIVES_ENABLED': 'false',
+            'PYTHONDONTWRITEBYTECODE': '1',
+        })
+
+        print(f"{'сценарий':<16} {'медиана мс':>11} {'мин мс':>8} {'импорт мс':>10}  тяжелые модули")
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            # Первый запуск прогревает кэш байткода и диска и в замер не входит
+            run_once(scenario, env)
+            timings = [run_once(scenario, env)[0] for _ in range(args.repeat)]
+            _, stderr = run_once(scenario, env, importtime=True)
+            modules = parse_importtime(stderr)
+
+            heavy = [module for module in HEAVY_MODULES if module in modules]
+            # Суммируются только внешние импорты, иначе вложенные модули считаются дважды
+            top_level = {module: us for module, (us, depth) in modules.items() if depth == 0}
+            result = {
+                'ts': round(time.time(), 3),
+                'revision': revision,
+                'python': sys.version.split()[0],
+                'scenario': name,
+                'median_ms': round(statistics.median(timings) * 1000, 1),
+                'min_ms': round(min(timings) * 1000, 1),
+                'import_ms': round(sum(top_level.values()) / 1000, 1),
+                'heavy_modules': heavy,
+                'top_imports_ms': {
+                    module: round(us / 1000, 1)
+                    for module, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]
+                },
+            }
+            print(f"{name:<16} {result['median_ms']:>11} {result['min_ms']:>8} {result['import_ms']:>10}  "
+                  f"{', '.join(heavy) or '-'}")
+
+            if args.output:
+                Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+                with open(args.output, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    if args.output:
+        print(f"\n📈 Результаты добавлены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()